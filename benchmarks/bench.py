@@ -0,0 +1,280 @@
+"""
+Benchmark suite for diff-pdf-gui.
+
+    python benchmarks/bench.py                    # run, compare against baselines.json
+    python benchmarks/bench.py --full             # include the 100k-file directory
+    python benchmarks/bench.py --update-baselines # record the current numbers
+    python benchmarks/bench.py --only autofill    # substring filter on benchmark names
+
+diff-pdf.exe is replaced by fake_diff_pdf.py (latency via --latency), so everything runs
+on Linux. PDF benchmarks need PyMuPDF; the raster engine also needs NumPy; STEP loading
+needs build123d and pyvista. A benchmark is a regression when it is slower than its
+baseline by more than --tolerance (default 50%).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINES_PATH = os.path.join(BENCH_DIR, "baselines.json")
+
+sys.path.insert(0, BENCH_DIR)
+import corpus
+
+
+def load_app():
+    """Imports diff-pdf-gui.py (not importable by name because of the hyphens)."""
+    spec = importlib.util.spec_from_file_location("diff_pdf_gui", os.path.join(REPO_DIR, "diff-pdf-gui.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["diff_pdf_gui"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_fake_diff_pdf(app, workdir, latency):
+    """Points the app at fake_diff_pdf.py through a small launcher script."""
+    os.environ["FAKE_DIFF_PDF_LATENCY"] = str(latency)
+    fake = os.path.join(BENCH_DIR, "fake_diff_pdf.py")
+    if sys.platform == "win32":
+        launcher = os.path.join(workdir, "diff-pdf.cmd")
+        with open(launcher, "w") as f:
+            f.write(f'@"{sys.executable}" "{fake}" %*\r\n')
+    else:
+        launcher = os.path.join(workdir, "diff-pdf")
+        with open(launcher, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake}" "$@"\n')
+        os.chmod(launcher, 0o755)
+    app.DIFF_PDF_COMMAND = launcher
+    app.DIFF_PDF_DIR = workdir
+
+
+def timed(fn, repeat=3):
+    """Runs fn `repeat` times; returns the median wall time in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+# --- BENCHMARKS ---
+def bench_extract_revision(app, ctx):
+    names = [os.path.splitext(n)[0] for n in ctx['names_10k']]
+    return timed(lambda: [app.extract_revision(n) for n in names])
+
+
+def bench_autofill(app, ctx, key):
+    directory = ctx[key]
+    names = ctx['names_' + key.split('_')[1]]
+    queries = random.Random(1).sample([n for n in names if n.endswith(".pdf")], 200)
+
+    def cold():
+        app._revision_indexes.clear()
+        app.find_revision_match(os.path.join(directory, queries[0]), "next")
+
+    def warm():
+        for i, name in enumerate(queries):
+            app.find_revision_match(os.path.join(directory, name), "next" if i % 2 else "prev")
+
+    results = {f"autofill_cold_{key.split('_')[1]}": timed(cold)}
+    app.find_revision_match(os.path.join(directory, queries[0]), "next")
+    results[f"autofill_warm_200_lookups_{key.split('_')[1]}"] = timed(warm)
+    return results
+
+
+def bench_run_diff(app, ctx, engine_name):
+    """The comparison run_diff queues: hashing, fingerprints, engine and stitching; cache disabled."""
+    a, b = ctx['series'][0][:2]
+    out = os.path.join(ctx['workdir'], f"run_diff_{engine_name}.pdf")
+    engine = app.get_diff_engine(engine_name)
+
+    def run():
+        res, _ = app.run_pdf_diff_cached(a, b, out, cache=None, engine=engine)
+        assert res.returncode in (0, 1), res.stderr
+
+    return timed(run)
+
+
+def bench_text_diff(app, ctx):
+    """Text-layer triage over a 500-page package."""
+    a, b = ctx['package']
+
+    def run():
+        report = app.text_diff(a, b)
+        assert report['changed'], report
+
+    return timed(run)
+
+
+def bench_chain(app, ctx):
+    """Rev1 -> Rev2 -> Rev3 through the raster engine with shared renders; cache disabled."""
+    files = ctx['series'][0]
+    out_dir = os.path.join(ctx['workdir'], "chain_out")
+
+    def run():
+        report = app.run_chain(files, out_dir, engine=app.get_diff_engine("raster"))
+        assert report['failed'] == 0, report
+
+    return timed(run)
+
+
+def bench_step_load(app, ctx):
+    """load_step_mesh on a fresh mesh cache (parse + tessellate) and on a populated one (memory-map)."""
+    path = ctx['step']
+    cache_dir = os.path.join(ctx['workdir'], "mesh_cache")
+
+    def cold():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        app.load_step_mesh(path, app.RedlineCache(cache_dir, app.MESH_CACHE_MAX_BYTES))
+
+    def warm():
+        app.load_step_mesh(path, cache)
+
+    results = {'step_load_cold': timed(cold)}
+    cache = app.RedlineCache(cache_dir, app.MESH_CACHE_MAX_BYTES)
+    app.load_step_mesh(path, cache)
+    results['step_load_warm'] = timed(warm)
+    return results
+
+
+def bench_batch(app, ctx):
+    root = ctx['pdf_dir']
+    summary_path = os.path.join(ctx['workdir'], "batch_summary.json")
+    out_dir = os.path.join(ctx['workdir'], "batch_out")
+
+    def run():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        summary = app.run_batch(root, out_dir, jobs=4, summary_path=summary_path, engine=app.DiffPdfEngine())
+        assert summary['failed'] == 0, summary
+
+    seconds = timed(run, repeat=2)
+    pairs = len(app.find_revision_pairs(root))
+    return {'batch_seconds_per_pair': seconds / max(1, pairs)}
+
+
+# --- RUNNER ---
+def build_context(workdir, full, only=None):
+    ctx = {'workdir': workdir, 'series': None}
+    ctx['dir_10k'] = os.path.join(workdir, "dir_10k")
+    ctx['names_10k'] = corpus.make_revision_tree(ctx['dir_10k'], 10000)
+    if full:
+        ctx['dir_100k'] = os.path.join(workdir, "dir_100k")
+        ctx['names_100k'] = corpus.make_revision_tree(ctx['dir_100k'], 100000, seed=1)
+    if not only or any(only in name for name in ("step_load_cold", "step_load_warm")):
+        build_step_context(ctx)
+    if only and not any(only in name for name in ("run_diff", "batch", "text_diff", "chain")):
+        return ctx
+    try:
+        ctx['pdf_dir'] = os.path.join(workdir, "pdfs")
+        ctx['series'] = list(corpus.make_revision_pdfs(ctx['pdf_dir'], drawings=6, revisions=3, pages=40, changed_pages=2).values())
+        if not only or only in "text_diff_500_pages":
+            package = corpus.make_revision_pdfs(os.path.join(workdir, "package"), drawings=1, revisions=2, pages=500, changed_pages=3)
+            ctx['package'] = list(package.values())[0]
+    except ImportError:
+        print("PyMuPDF not installed; skipping PDF benchmarks.")
+    return ctx
+
+
+def build_step_context(ctx):
+    """One STEP part for the mesh-cache benchmarks, when build123d and pyvista are installed."""
+    try:
+        import numpy, pyvista  # noqa: F401 (load_step_mesh builds its meshes with them)
+        ctx['step'] = corpus.make_step_fixture(os.path.join(ctx['workdir'], "part.step"), hole=2.0)
+    except ImportError:
+        print("build123d/pyvista not installed; skipping STEP benchmarks.")
+
+
+def run_all(app, ctx, only=None):
+    results = {}
+
+    def want(name):
+        return not only or only in name
+
+    if want("extract_revision"):
+        results['extract_revision_10k'] = bench_extract_revision(app, ctx)
+    for key in ("dir_10k", "dir_100k"):
+        if key in ctx and want("autofill"):
+            results.update(bench_autofill(app, ctx, key))
+    if ctx['series']:
+        if want("run_diff"):
+            results['run_diff_diff-pdf'] = bench_run_diff(app, ctx, "diff-pdf")
+            if app.RasterDiffEngine().available():
+                results['run_diff_raster'] = bench_run_diff(app, ctx, "raster")
+        if want("chain") and app.RasterDiffEngine().available():
+            results['chain_3_revisions_raster'] = bench_chain(app, ctx)
+        if want("batch"):
+            results.update(bench_batch(app, ctx))
+        if 'package' in ctx and want("text_diff"):
+            results['text_diff_500_pages'] = bench_text_diff(app, ctx)
+    if 'step' in ctx and want("step_load"):
+        results.update(bench_step_load(app, ctx))
+    return results
+
+
+def compare(results, baselines, tolerance):
+    regressions = []
+    print(f"{'benchmark':<36}{'seconds':>10}{'baseline':>10}{'ratio':>8}")
+    for name, seconds in sorted(results.items()):
+        base = baselines.get(name)
+        ratio = seconds / base if base else None
+        flag = ""
+        if ratio and ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        base_s = f"{base:>10.4f}" if base else f"{'-':>10}"
+        ratio_s = f"{ratio:>8.2f}" if ratio else f"{'-':>8}"
+        print(f"{name:<36}{seconds:>10.4f}{base_s}{ratio_s}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="diff-pdf-gui benchmarks")
+    parser.add_argument("--full", action="store_true", help="Also build and scan a 100k-file directory")
+    parser.add_argument("--only", help="Run benchmarks whose name contains this text")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake diff-pdf latency in seconds (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown vs baseline (default: %(default)s)")
+    parser.add_argument("--update-baselines", action="store_true", help="Write the results to baselines.json")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated corpus directory")
+    args = parser.parse_args(argv)
+
+    app = load_app()
+    workdir = tempfile.mkdtemp(prefix="diffpdf-bench-")
+    try:
+        install_fake_diff_pdf(app, workdir, args.latency)
+        print(f"Building corpus in {workdir}...")
+        ctx = build_context(workdir, args.full, args.only)
+        results = run_all(app, ctx, args.only)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    regressions = compare(results, baselines, args.tolerance)
+    if args.update_baselines:
+        baselines.update({k: round(v, 4) for k, v in results.items()})
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {BASELINES_PATH}")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
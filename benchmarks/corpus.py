@@ -0,0 +1,75 @@
+"""Synthetic inputs for the benchmarks: revisioned PDF sets, STEP fixtures and large revision-named directories."""
+import os
+import random
+
+# Naming styles seen on the drawing shares; all must be understood by extract_revision()
+NAME_STYLES = ("{part}_Rev{rev}", "{part}_v{rev}", "{part}-{rev:02d}", "{part}-REV{rev}_Released")
+
+
+def make_revision_tree(directory, count, ext=".pdf", seed=0):
+    """Creates `count` empty revision-named files (mixed styles, extensions and non-matching names)."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    names = set()
+    while len(names) < count:
+        if rng.random() < 0.02:
+            # A sprinkling of names without a revision exercises the fuzzy fallback
+            names.add(f"Drawing {rng.randint(0, count)} assembly{ext}")
+            continue
+        style = rng.choice(NAME_STYLES)
+        part = f"DWG-{rng.randint(10000, 10000 + count // 8)}"
+        file_ext = ext if rng.random() < 0.8 else rng.choice((".step", ".PDF", ".dxf"))
+        names.add(style.format(part=part, rev=rng.randint(0, 15)) + file_ext)
+    for name in names:
+        open(os.path.join(directory, name), "w").close()
+    return sorted(names)
+
+
+def make_revision_pdfs(directory, drawings=5, revisions=3, pages=20, changed_pages=1, seed=0):
+    """
+    Writes `drawings` PDF series of `revisions` revisions each. Every revision changes the
+    title block on `changed_pages` random sheets. Returns {part: [path_rev1, path_rev2, ...]}.
+    """
+    import pymupdf
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    series = {}
+    for d in range(drawings):
+        part = f"DWG-{1000 + d}"
+        stamps = ["A"] * pages
+        paths = []
+        for rev in range(1, revisions + 1):
+            if rev > 1:
+                for page in rng.sample(range(pages), min(changed_pages, pages)):
+                    stamps[page] = chr(ord("A") + rev - 1)
+            doc = pymupdf.open()
+            for page_no in range(pages):
+                page = doc.new_page(width=1190, height=842) # A3 landscape
+                page.draw_rect(pymupdf.Rect(20, 20, 1170, 822), width=1.5)
+                for i in range(12):
+                    x = 60 + i * 90
+                    page.draw_line((x, 80), (x + 60, 600), width=0.8)
+                    page.draw_circle((x + 30, 680), 20, width=0.8)
+                page.insert_text((60, 60), f"{part} sheet {page_no + 1}", fontsize=14)
+                page.draw_rect(pymupdf.Rect(900, 740, 1170, 822), width=1)
+                page.insert_text((910, 790), f"REV {stamps[page_no]}", fontsize=18)
+            path = os.path.join(directory, f"{part}_Rev{rev}.pdf")
+            doc.save(path)
+            doc.close()
+            paths.append(path)
+        series[part] = paths
+    return series
+
+
+def make_step_fixture(path, size=10.0, hole=0.0):
+    """
+    Writes a small STEP part: a box of `size` mm, optionally with a hole so revisions differ.
+    Needs build123d (raises ImportError without it).
+    """
+    from build123d import Box, Cylinder, export_step
+    part = Box(size, size, size)
+    if hole:
+        part -= Cylinder(hole, size)
+    export_step(part, path)
+    return path
@@ -0,0 +1,52 @@
+"""
+Stand-in for diff-pdf.exe so the benchmarks run anywhere.
+
+Accepts the same command line the GUI builds:
+    fake_diff_pdf.py --output-diff=OUT.pdf NEW.pdf OLD.pdf
+
+Sleeps FAKE_DIFF_PDF_LATENCY seconds (default 0.05) plus FAKE_DIFF_PDF_PER_PAGE per page
+when PyMuPDF can count them, copies NEW to OUT, and exits like diff-pdf:
+0 = identical, 1 = different, 2 = bad arguments / unreadable input.
+"""
+import os
+import sys
+import time
+import shutil
+import filecmp
+
+
+def page_count(path):
+    try:
+        import pymupdf
+        with pymupdf.open(path) as doc:
+            return len(doc)
+    except Exception:
+        return 1
+
+
+def main(argv):
+    output = None
+    files = []
+    for arg in argv:
+        if arg.startswith("--output-diff="):
+            output = arg.split("=", 1)[1]
+        elif not arg.startswith("--"):
+            files.append(arg)
+
+    if len(files) != 2 or not all(os.path.exists(f) for f in files):
+        sys.stderr.write(f"Error opening {files}\n")
+        return 2
+
+    latency = float(os.environ.get("FAKE_DIFF_PDF_LATENCY", "0.05"))
+    per_page = float(os.environ.get("FAKE_DIFF_PDF_PER_PAGE", "0"))
+    if per_page:
+        latency += per_page * page_count(files[0])
+    time.sleep(latency)
+
+    if output:
+        shutil.copyfile(files[0], output)
+    return 0 if filecmp.cmp(files[0], files[1], shallow=False) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,9 +5,27 @@ from tkinter import filedialog, messagebox, ttk
 import subprocess
 import shutil
 import threading
+import queue
 import time
 import difflib
 import re # Added for revision number parsing
+import bisect
+from collections import OrderedDict
+import json
+import hashlib
+import tempfile
+import zlib
+import argparse
+import atexit
+import contextlib
+import html
+import uuid
+import ipaddress
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 
 # --- CONFIGURATION & SETUP ---
 
@@ -27,16 +45,163 @@ else:
 DIFF_PDF_DIR = os.path.join(SCRIPT_DIR, 'diff-pdf-bin')
 DIFF_PDF_COMMAND = os.path.join(DIFF_PDF_DIR, 'diff-pdf.exe')
 
+# Redline cache (content-addressed, LRU-evicted)
+CACHE_DIR = os.path.join(APP_DIR, 'redline_cache')
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Tessellated STEP meshes (NumPy arrays, memory-mapped on load)
+MESH_CACHE_DIR = os.path.join(APP_DIR, 'mesh_cache')
+MESH_CACHE_MAX_BYTES = 4 * 1024 ** 3
+STEP_TOLERANCE = 0.1 # Matches diff3d.load()
+
+# Anything that changes diff output belongs here (or in DiffEngine.options) so it becomes part of the cache key
+PDF_DIFF_OPTIONS = {'page_narrowing': True}
+FINGERPRINT_MEMO_FILES = 64 # Documents whose page fingerprints stay memoized (least recently used dropped)
+
+# Diff engine: 'auto' prefers diff-pdf.exe when bundled, else the in-process raster engine
+DEFAULT_DIFF_ENGINE = 'auto'
+RASTER_DPI = 150
+RASTER_TOLERANCE = 16 # Per-channel difference ignored as anti-aliasing noise
+RASTER_MAX_MEMORY_MB = 1024 # Ceiling for pages held in flight by the raster engine
+
+# Optional 3D dependencies, probed once and cached per interpreter/package versions
+PROBE_MODULES = ('diff3d', 'pyvista', 'build123d')
+CAPABILITY_CACHE = os.path.join(APP_DIR, 'capabilities.json')
+
+# Number of warm 3D worker processes kept alive for STEP comparisons
+DIFF3D_WORKERS = 2
+
+# Headless 3D renders: fixed camera views written next to the redline
+DIFF3D_VIEWS = ('iso', 'front', 'top', 'side')
+DIFF3D_VIEW_SIZE = (1600, 1200)
+
+# Shared comparison service (--serve); the GUI submits to it whenever one answers at SERVICE_URL
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+SERVICE_QUEUE_MAX = 32   # Waiting jobs accepted before clients are told to back off (HTTP 503)
+SERVICE_KEEP_JOBS = 256  # Finished jobs whose redlines stay downloadable
+SERVICE_ENV = 'DIFF_PDF_SERVICE'
+SERVICE_URL = os.environ.get(SERVICE_ENV, f"http://{SERVICE_HOST}:{SERVICE_PORT}")
+
+# Keep helper processes from flashing a console window on Windows
+SUBPROCESS_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+
+# Stage timings (--profile): JSON-lines spans, shared by every process of a session
+TRACE_PATH = os.path.join(APP_DIR, 'trace.jsonl')
+TRACE_ENV = 'DIFF_PDF_TRACE'                 # Path to append spans to; set => tracing on
+TRACE_SESSION_ENV = 'DIFF_PDF_TRACE_SESSION' # Groups spans from child processes with their parent
+
 # 2. Debug Logging
-def log_debug(msg):
+class BufferedLineWriter:
+    """
+    Appends lines to a file in batches instead of reopening it for every line. A buffered line
+    is written at most max_delay seconds later, even if nothing else is logged after it.
+    """
+    def __init__(self, path, max_lines=64, max_delay=1.0):
+        self.path = path
+        self.max_lines = max_lines
+        self.max_delay = max_delay
+        self.lines = []
+        self.timer = None
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+        # A forked child must not re-write lines its parent still has buffered (its timer thread is gone too)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # The lock may have been held by another parent thread at fork time; it would never be released here
+        self.lock = threading.Lock()
+        self.lines.clear()
+        self.timer = None
+
+    def write(self, line):
+        with self.lock:
+            self.lines.append(line)
+            due = len(self.lines) >= self.max_lines
+            if not due and self.timer is None:
+                self.timer = threading.Timer(self.max_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if due: self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines[:] = list(self.lines), []
+            timer, self.timer = self.timer, None
+        if timer: timer.cancel()
+        if not lines: return
+        try:
+            with open(self.path, "a") as f:
+                f.write("".join(f"{line}\n" for line in lines))
+        except:
+            pass
+
+_debug_log = BufferedLineWriter(os.path.join(APP_DIR, "debug_args.txt"))
+
+def log_debug(msg, flush=False):
+    _debug_log.write(msg)
+    if flush: _debug_log.flush() # Fatal paths: the process may be killed before the timer fires
+
+log_debug(f"STARTUP ARGS: {sys.argv}")
+
+# 3. Tracing
+_trace_log = BufferedLineWriter(os.environ[TRACE_ENV]) if os.environ.get(TRACE_ENV) else None
+
+def enable_tracing(path=TRACE_PATH):
+    """Turns on span recording for this process and every child it launches. Returns the session id."""
+    global _trace_log
+    session = os.environ.get(TRACE_SESSION_ENV) or f"{os.getpid()}-{int(time.time())}"
+    os.environ[TRACE_ENV] = path
+    os.environ[TRACE_SESSION_ENV] = session
+    _trace_log = BufferedLineWriter(path)
+    return session
+
+def flush_tracing():
+    if _trace_log: _trace_log.flush()
+
+@contextlib.contextmanager
+def trace_span(stage, **attrs):
+    """Times the enclosed block as one span. Extra attributes may be added to the yielded dict."""
+    if _trace_log is None:
+        yield attrs
+        return
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record = {'stage': stage, 'start': round(start, 6), 'seconds': round(time.perf_counter() - t0, 6),
+                  'pid': os.getpid(), 'thread': threading.current_thread().name, 'session': os.environ.get(TRACE_SESSION_ENV)}
+        record.update(attrs)
+        _trace_log.write(json.dumps(record, default=str))
+
+def summarize_trace(path, session=None):
+    """Aggregates spans per stage: {stage: {'count', 'total', 'mean', 'max'}}."""
+    stages = {}
     try:
-        log_path = os.path.join(APP_DIR, "debug_args.txt")
-        with open(log_path, "a") as f:
-            f.write(f"{msg}\n")
-    except:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if session and record.get('session') != session: continue
+                stats = stages.setdefault(record['stage'], {'count': 0, 'total': 0.0, 'max': 0.0})
+                stats['count'] += 1
+                stats['total'] += record['seconds']
+                stats['max'] = max(stats['max'], record['seconds'])
+    except OSError:
         pass
+    for stats in stages.values():
+        stats['mean'] = stats['total'] / stats['count']
+    return stages
 
-log_debug(f"STARTUP ARGS: {sys.argv}")
+def format_stage_summary(stages):
+    lines = [f"{'stage':<28}{'count':>7}{'total s':>11}{'mean s':>10}{'max s':>10}"]
+    for stage, stats in sorted(stages.items(), key=lambda kv: kv[1]['total'], reverse=True):
+        lines.append(f"{stage:<28}{stats['count']:>7}{stats['total']:>11.3f}{stats['mean']:>10.3f}{stats['max']:>10.3f}")
+    return "\n".join(lines)
 
 # --- Import tkinterdnd2 ---
 try:
@@ -44,55 +209,2268 @@ try:
 except ImportError:
     TkinterDnD = None
 
+# --- Import PyMuPDF & NumPy (optional: page fingerprinting, raster engine) ---
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
 
-# --- 3D VIEWER LOGIC (Run in subprocess) ---
-def run_3d_viewer_mode(file_a, file_b, save_dir):
-    try:
-        log_debug("Starting 3D Viewer Mode...")
-        import pyvista as pv
-        import vtk
-        import diff3d
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-        pv.global_theme.interactive = True
-        target_image_name = "screenshot.png"
-        
-        # Monkey Patch show() for auto-screenshot
-        OriginalShow = pv.Plotter.show
 
-        def patched_show(self, *args, **kwargs):
-            def auto_capture(*_):
-                try:
-                    self.screenshot(target_image_name, return_img=False)
-                except:
-                    pass
+# --- 3D VIEWER LOGIC (Run in subprocess) ---
+# Where the patched Plotter.show() saves its capture; switched per job by the warm worker
+_screenshot = {'target': "screenshot.png"}
 
-            if hasattr(self, 'iren') and self.iren:
-                self.iren.add_observer(vtk.vtkCommand.EndInteractionEvent, auto_capture)
+def install_screenshot_hook(pv, vtk):
+    # Monkey Patch show() for auto-screenshot
+    OriginalShow = pv.Plotter.show
 
+    def patched_show(self, *args, **kwargs):
+        def auto_capture(*_):
             try:
-                self.render()
-                auto_capture()
+                with trace_span('step3d.screenshot'):
+                    self.screenshot(_screenshot['target'], return_img=False)
+                flush_tracing()
             except:
                 pass
 
-            return OriginalShow(self, *args, **kwargs)
+        if hasattr(self, 'iren') and self.iren:
+            self.iren.add_observer(vtk.vtkCommand.EndInteractionEvent, auto_capture)
+
+        try:
+            with trace_span('step3d.render'):
+                self.render()
+            auto_capture()
+        except:
+            pass
+
+        return OriginalShow(self, *args, **kwargs)
+
+    pv.Plotter.show = patched_show
 
-        pv.Plotter.show = patched_show
+def run_3d_viewer_mode(file_a, file_b, save_dir):
+    try:
+        log_debug("Starting 3D Viewer Mode...")
+        with trace_span('step3d.import'):
+            import pyvista as pv
+            import vtk
+            import diff3d
+
+        pv.global_theme.interactive = True
+        target_image_name = "screenshot.png"
+        _screenshot['target'] = target_image_name
+        install_screenshot_hook(pv, vtk)
 
         os.chdir(save_dir)
         
         if os.path.exists(target_image_name):
             os.remove(target_image_name)
 
+        install_mesh_cache(diff3d)
         log_debug(f"Diffing: {file_a} vs {file_b}")
         diff3d.from_files(file_a, file_b)
         
     except Exception as e:
-        log_debug(f"3D CRASH: {e}")
+        log_debug(f"3D CRASH: {e}", flush=True)
         with open(os.path.join(save_dir, "diff3d_error.log"), "w") as f:
             f.write(f"Error running 3D viewer: {str(e)}")
         sys.exit(1)
 
+def load_step_mesh(path, cache, tolerance=STEP_TOLERANCE):
+    """
+    Loads a STEP file as pyvista PolyData through the mesh cache. A miss parses and tessellates
+    with build123d (as diff3d.load does) and stores points/faces as .npy; a hit memory-maps them.
+    """
+    with trace_span('step.load', file=os.path.basename(path)) as span:
+        span['cached'] = False
+        return _load_step_mesh(path, cache, tolerance, span)
+
+def _load_step_mesh(path, cache, tolerance, span):
+    import numpy
+    import pyvista
+
+    key = cache.content_key([path], {'kind': 'step-mesh', 'tolerance': tolerance})
+    if cache.lookup(key):
+        entry = cache.entry_dir(key)
+        try:
+            points = numpy.load(os.path.join(entry, "points.npy"), mmap_mode='r')
+            faces = numpy.load(os.path.join(entry, "faces.npy"), mmap_mode='r')
+            log_debug(f"Mesh cache hit: {path}")
+            span['cached'] = True
+            return pyvista.PolyData.from_regular_faces(points, faces)
+        except (OSError, ValueError) as e:
+            log_debug(f"MESH CACHE ERROR: {e}")
+
+    import build123d
+    step = build123d.importers.import_step(path)
+    points, faces = step.tessellate(tolerance=tolerance)
+    points = numpy.array([tuple(p) for p in points], dtype=numpy.float64)
+    faces = numpy.array(faces, dtype=numpy.int64).reshape(-1, 3)
+    print(f"{len(points)} points, {len(faces)} faces")
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="diffpdf-mesh-") as tmp:
+            numpy.save(os.path.join(tmp, "points.npy"), points)
+            numpy.save(os.path.join(tmp, "faces.npy"), faces)
+            cache.store(key, {'points.npy': os.path.join(tmp, "points.npy"), 'faces.npy': os.path.join(tmp, "faces.npy")},
+                        {'source': os.path.basename(path), 'tolerance': tolerance})
+    except Exception as e:
+        log_debug(f"MESH CACHE ERROR: {e}")
+    return pyvista.PolyData.from_regular_faces(points, faces)
+
+def install_mesh_cache(diff3d, cache=None):
+    """Routes diff3d.load() for STEP files through load_step_mesh(); other formats load as before."""
+    cache = cache or RedlineCache(MESH_CACHE_DIR, MESH_CACHE_MAX_BYTES)
+    original_load = diff3d.load
+
+    def cached_load(path):
+        if path.lower().endswith((".step", ".stp")):
+            return load_step_mesh(path, cache)
+        return original_load(path)
+
+    diff3d.load = cached_load
+
+# Camera presets for headless renders (pyvista Plotter methods)
+VIEW_CAMERAS = {'iso': 'view_isometric', 'front': 'view_xz', 'top': 'view_xy', 'side': 'view_yz'}
+
+def egl_available():
+    import ctypes
+    for name in ('libEGL.so.1', 'libEGL.so'):
+        try:
+            ctypes.CDLL(name)
+            return True
+        except OSError:
+            pass
+    return False
+
+def prepare_headless_vtk():
+    """
+    Switches pyvista to off-screen rendering; call before the first Plotter is created.
+    VTK picks its own window (X, then EGL, then OSMesa). Only on Linux without a display and
+    without a loadable libEGL is it pointed at OSMesa; VTK_DEFAULT_OPENGL_WINDOW always wins.
+    """
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY') \
+            and not egl_available():
+        os.environ.setdefault('VTK_DEFAULT_OPENGL_WINDOW', 'vtkOSOpenGLRenderWindow')
+    import pyvista as pv
+    pv.OFF_SCREEN = True
+    pv.global_theme.interactive = False
+    return pv
+
+def install_views_hook(pv):
+    """Replaces Plotter.show() with a non-interactive capture of each view in _screenshot['views_job']."""
+    def capture_views(self, *args, **kwargs):
+        job = _screenshot['views_job']
+        self.window_size = list(job['size'])
+        written = []
+        for view in job['views']:
+            with trace_span('step3d.screenshot', view=view):
+                getattr(self, VIEW_CAMERAS[view])()
+                self.reset_camera()
+                path = f"{job['prefix']}-{view}.png"
+                self.screenshot(path, return_img=False)
+            written.append(path)
+        _screenshot['written'] = written
+        self.close()
+
+    pv.Plotter.show = capture_views
+
+def view_image_prefix(output_path):
+    """Headless 3D renders sit next to the redline: <redline>-3d-<view>.png"""
+    return os.path.splitext(output_path)[0] + "-3d"
+
+def run_3d_job(diff3d, job):
+    """Executes one worker job: interactive capture to job['image'] or headless views under job['prefix']."""
+    if 'views' in job:
+        _screenshot['views_job'] = job
+        _screenshot['written'] = []
+        diff3d.from_files(job['step_a'], job['step_b'])
+        images = _screenshot['written']
+        return {'ok': bool(images) and all(os.path.exists(p) for p in images), 'images': images}
+
+    if os.path.exists(job['image']): os.remove(job['image'])
+    _screenshot['target'] = job['image']
+    diff3d.from_files(job['step_a'], job['step_b'])
+    return {'ok': os.path.exists(job['image']), 'image': job['image']}
+
+def render_3d_views(step_a, step_b, prefix, views=DIFF3D_VIEWS, size=DIFF3D_VIEW_SIZE):
+    """One-shot headless render of the fixed views, in this process. Returns the image paths."""
+    with trace_span('step3d.import', headless=True):
+        pv = prepare_headless_vtk()
+        import diff3d
+    install_mesh_cache(diff3d)
+    install_views_hook(pv)
+    result = run_3d_job(diff3d, {'step_a': step_a, 'step_b': step_b, 'prefix': prefix, 'views': list(views), 'size': list(size)})
+    return result['images']
+
+def run_3d_worker_mode(headless=False):
+    """
+    Long-lived 3D worker: imports pyvista/vtk/diff3d once, then serves JSON-line jobs from stdin,
+    answering each on the protocol stream. Jobs are {"id", "step_a", "step_b", "image"} for the
+    interactive viewer, or {"id", "step_a", "step_b", "prefix", "views", "size"} when headless.
+    """
+    # diff3d prints progress to stdout; keep the real stdout for the protocol only
+    proto = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    jobs = sys.stdin or os.fdopen(0)
+
+    try:
+        with trace_span('step3d.import', headless=headless):
+            if headless:
+                pv = prepare_headless_vtk()
+                install_views_hook(pv)
+            else:
+                import pyvista as pv
+                import vtk
+                pv.global_theme.interactive = True
+                install_screenshot_hook(pv, vtk)
+            import diff3d
+        install_mesh_cache(diff3d)
+    except Exception as e:
+        log_debug(f"3D WORKER IMPORT ERROR: {e}")
+        proto.write(json.dumps({'ready': False, 'error': str(e)}) + "\n")
+        return 1
+    proto.write(json.dumps({'ready': True}) + "\n")
+
+    for line in jobs:
+        if not line.strip(): continue
+        job = json.loads(line)
+        try:
+            log_debug(f"Worker diffing: {job['step_a']} vs {job['step_b']}")
+            with trace_span('step3d.job', headless=headless):
+                result = run_3d_job(diff3d, job)
+        except Exception as e:
+            log_debug(f"3D WORKER JOB ERROR: {e}")
+            result = {'ok': False, 'error': str(e)}
+        result['id'] = job.get('id')
+        flush_tracing()
+        proto.write(json.dumps(result) + "\n")
+    return 0
+
+def run_render_3d_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --render-3d", description="Render fixed views of a STEP diff without a window.")
+    parser.add_argument("step_a")
+    parser.add_argument("step_b")
+    parser.add_argument("prefix", help="Output path prefix; views are written as <prefix>-<view>.png")
+    parser.add_argument("--views", default=",".join(DIFF3D_VIEWS), help="Comma-separated subset of: " + ", ".join(VIEW_CAMERAS))
+    parser.add_argument("--size", default="%dx%d" % DIFF3D_VIEW_SIZE, help="Image size WxH (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    views = [v.strip() for v in args.views.split(",") if v.strip()]
+    unknown = [v for v in views if v not in VIEW_CAMERAS]
+    if unknown: parser.error(f"unknown view(s): {', '.join(unknown)}")
+    size = tuple(int(x) for x in args.size.lower().split("x"))
+
+    for path in render_3d_views(args.step_a, args.step_b, args.prefix, views, size):
+        print(path)
+    return 0
+
+# --- CAPABILITY PROBE (Optional 3D libraries) ---
+def self_command(*args):
+    """Command line that re-runs this program (script or frozen EXE) with args."""
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, *args]
+    return [sys.executable, os.path.abspath(__file__), *args]
+
+def probe_fingerprint():
+    """Identifies the interpreter and installed 3D package versions without importing them."""
+    import importlib.metadata
+    packages = {}
+    for name in PROBE_MODULES:
+        try:
+            packages[name] = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            packages[name] = None
+    try:
+        exe_mtime = os.stat(sys.executable).st_mtime_ns
+    except OSError:
+        exe_mtime = None
+    return {'executable': sys.executable, 'executable_mtime': exe_mtime, 'python': sys.version, 'packages': packages}
+
+def load_cached_capabilities():
+    """Returns the cached probe result if it was recorded for this exact environment, else None."""
+    try:
+        with open(CAPABILITY_CACHE) as f:
+            cached = json.load(f)
+        if cached.get('fingerprint') == probe_fingerprint():
+            return cached['capabilities']
+    except Exception:
+        pass
+    return None
+
+def probe_capabilities():
+    """Imports the 3D stack in a child process (it is slow and may crash) and caches the outcome."""
+    try:
+        with trace_span('probe_3d'):
+            res = subprocess.run(self_command("--probe-3d"), capture_output=True, timeout=300, creationflags=SUBPROCESS_FLAGS)
+        capabilities = {'diff3d': res.returncode == 0}
+    except Exception as e:
+        log_debug(f"PROBE ERROR: {e}")
+        return {'diff3d': False}
+    try:
+        with open(CAPABILITY_CACHE, "w") as f:
+            json.dump({'fingerprint': probe_fingerprint(), 'capabilities': capabilities}, f, indent=2)
+    except OSError:
+        pass
+    return capabilities
+
+def get_capabilities():
+    return load_cached_capabilities() or probe_capabilities()
+
+def run_probe_mode():
+    """Child side of probe_capabilities(): exit 0 if the 3D stack imports cleanly."""
+    try:
+        for name in PROBE_MODULES:
+            __import__(name)
+    except Exception as e:
+        log_debug(f"PROBE: {e}")
+        return 1
+    return 0
+
+# --- WARM 3D WORKERS ---
+class Diff3DWorker:
+    """One --run-3d-worker child. Restarted transparently if it dies mid-job."""
+    def __init__(self, headless=False):
+        self.headless = headless
+        self.proc = None
+        self.ready = False
+        self.jobs_done = 0
+
+    def start(self):
+        args = ["--run-3d-worker"] + (["--headless"] if self.headless else [])
+        self.proc = subprocess.Popen(self_command(*args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, text=True, bufsize=1, creationflags=SUBPROCESS_FLAGS)
+        self.ready = False
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def _read(self):
+        line = self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"3D worker exited (code {self.proc.wait()})")
+        return json.loads(line)
+
+    def run(self, job):
+        """Sends a job dict (see run_3d_worker_mode) and blocks until it finishes. Returns the result dict."""
+        if not self.alive(): self.start()
+        try:
+            if not self.ready:
+                hello = self._read()
+                if not hello.get('ready'):
+                    raise RuntimeError(hello.get('error', "3D worker failed to start"))
+                self.ready = True
+            self.jobs_done += 1
+            self.proc.stdin.write(json.dumps(dict(job, id=self.jobs_done)) + "\n")
+            self.proc.stdin.flush()
+            return self._read()
+        except (OSError, ValueError, RuntimeError) as e:
+            log_debug(f"3D WORKER CRASH: {e}")
+            self.stop()
+            # Warm a replacement now so the next job doesn't pay the import cost
+            self.start()
+            return {'ok': False, 'error': str(e)}
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except Exception:
+                self.proc.kill()
+        self.proc = None
+
+class Diff3DWorkerPool:
+    """A few warm 3D workers shared by the GUI or batch runner; run() blocks for a free one."""
+    def __init__(self, size=DIFF3D_WORKERS, headless=False):
+        self.workers = [Diff3DWorker(headless) for _ in range(max(1, size))]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            worker.start() # Imports start now, in the background
+            self.idle.put(worker)
+
+    def run(self, job):
+        worker = self.idle.get()
+        try:
+            return worker.run(job)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+# --- REVISION MATCHING (Shared by GUI & Batch) ---
+def extract_revision(filename):
+    """Finds a revision number in a filename. Returns (prefix, separator, number, suffix)."""
+    # Priority 1: Explicit 'Rev' or 'v' (greedy start ensures we find the LAST instance)
+    # matches "Part_Rev1_..." -> "Part_", "Rev", "1", "_..."
+    match = re.search(r'(.*)(Rev|v)(\d+)(.*)', filename, re.IGNORECASE)
+    if match:
+        return match.groups()
+        
+    # Priority 2: Underscore or Hyphen separator (greedy start)
+    # matches "Part-02" -> "Part", "-", "02", ""
+    match = re.search(r'(.*)(_|-)(\d+)(.*)', filename, re.IGNORECASE)
+    if match:
+        return match.groups()
+        
+    return None
+
+def is_redline(filename):
+    """True for outputs of this tool (<name>-Redline.pdf, <name>-Chain-Redline.pdf), which are never revisions."""
+    return os.path.splitext(os.path.basename(filename))[0].endswith('-Redline')
+
+class RevisionIndex:
+    """
+    One directory's files, grouped by (extension, revision prefix) with revisions kept sorted
+    so next/prev is a bisect. A trigram index for the fuzzy fallback is built on first use.
+    Redlines written next to their sources are left out entirely.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.mtime = os.stat(directory).st_mtime_ns
+        self.files_by_ext = {}   # ext -> [filename]
+        self.groups = {}         # (ext, prefix) -> [(rev, filename)] sorted
+        self.revisions = {}      # (ext, prefix) -> [rev] parallel to groups, for bisect
+        self.ngrams = {}         # ext -> {trigram: set(filename)}
+        self.lock = threading.Lock()
+
+        with trace_span('autofill.scan', directory=directory) as span, os.scandir(directory) as it:
+            for entry in it:
+                if is_redline(entry.name): continue
+                name_no_ext, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                self.files_by_ext.setdefault(ext, []).append(entry.name)
+                rev_info = extract_revision(name_no_ext)
+                if rev_info:
+                    try:
+                        rev = int(rev_info[2])
+                    except:
+                        continue
+                    self.groups.setdefault((ext, rev_info[0].lower()), []).append((rev, entry.name))
+            span['files'] = sum(len(names) for names in self.files_by_ext.values())
+
+        for key, revs in self.groups.items():
+            revs.sort()
+            self.revisions[key] = [rev for rev, _ in revs]
+
+    @staticmethod
+    def trigrams(name):
+        name = f"  {name.lower()} "
+        return {name[i:i + 3] for i in range(len(name) - 2)}
+
+    def neighbour(self, filename, mode="next"):
+        """Next (smallest greater) or previous (largest smaller) revision of filename, or None."""
+        name_no_ext, ext = os.path.splitext(filename)
+        rev_info = extract_revision(name_no_ext)
+        if not rev_info: return None
+        try:
+            current_rev = int(rev_info[2])
+        except:
+            return None
+        key = (ext.lower(), rev_info[0].lower())
+        revs = self.revisions.get(key)
+        if not revs: return None
+
+        if mode == "next":
+            i = bisect.bisect_right(revs, current_rev)
+            return self.groups[key][i][1] if i < len(revs) else None
+        elif mode == "prev":
+            i = bisect.bisect_left(revs, current_rev)
+            return self.groups[key][i - 1][1] if i > 0 else None
+        return None
+
+    def closest(self, filename, shortlist=50, cutoff=0.6):
+        """Fuzzy match: trigram overlap narrows the candidates, SequenceMatcher ranks the shortlist."""
+        ext = os.path.splitext(filename)[1].lower()
+        with self.lock:
+            if ext not in self.ngrams:
+                grams = {}
+                for name in self.files_by_ext.get(ext, []):
+                    for g in self.trigrams(name):
+                        grams.setdefault(g, set()).add(name)
+                self.ngrams[ext] = grams
+        grams = self.ngrams[ext]
+
+        scores = {}
+        for g in self.trigrams(filename):
+            for name in grams.get(g, ()):
+                scores[name] = scores.get(name, 0) + 1
+        scores.pop(filename, None)
+        candidates = sorted(scores, key=scores.get, reverse=True)[:shortlist]
+        matches = difflib.get_close_matches(filename, candidates, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+_revision_indexes = {}
+_revision_indexes_lock = threading.Lock()
+
+def get_revision_index(directory):
+    """Returns the cached RevisionIndex for directory, rebuilding it when the directory mtime changes."""
+    directory = os.path.abspath(directory)
+    mtime = os.stat(directory).st_mtime_ns
+    with _revision_indexes_lock:
+        index = _revision_indexes.get(directory)
+    if index is None or index.mtime != mtime:
+        index = RevisionIndex(directory)
+        with _revision_indexes_lock:
+            _revision_indexes[directory] = index
+    return index
+
+def find_revision_match(current_path, mode="next"):
+    """
+    Finds the neighbouring revision of current_path in its directory. Returns a filename or None.
+    mode="next": Looks for revision > current (For File 1 -> File 2)
+    mode="prev": Looks for revision < current (For File 2 -> File 1)
+    """
+    with trace_span('autofill.match', mode=mode) as span:
+        filename = os.path.basename(current_path)
+        index = get_revision_index(os.path.dirname(current_path))
+
+        # 1. Try smart revision matching first
+        best_match_file = index.neighbour(filename, mode)
+
+        # 2. Fallback only if NO revision info was found in source (avoids matching wrong revs)
+        if not best_match_file and not extract_revision(os.path.splitext(filename)[0]):
+            span['fuzzy'] = True
+            best_match_file = index.closest(filename)
+
+    return best_match_file
+
+def find_step_file(pdf_path):
+    if not pdf_path: return None
+    base_path = os.path.splitext(pdf_path)[0]
+    for ext in ['.step', '.stp', '.STEP', '.STP']:
+        if os.path.exists(base_path + ext): return base_path + ext
+    return None
+
+def default_redline_name(file_b):
+    """Output filename used for a comparison whose newer revision is file_b."""
+    base_name = os.path.splitext(os.path.basename(file_b))[0]
+    return f"{base_name}-Redline.pdf"
+
+# --- RESULT CACHE ---
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def hash_file(path):
+    """SHA-256 of a file's contents, memoized on (path, size, mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes: return _file_hashes[memo_key]
+    h = hashlib.sha256()
+    with trace_span('hash_file', bytes=st.st_size), open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest
+    return digest
+
+class RedlineCache:
+    """
+    On-disk store of comparison results keyed by the content of both inputs plus the options.
+    Each entry is a directory holding the result files and a meta.json; the directory mtime
+    is bumped on every hit and the least recently used entries are evicted past max_bytes.
+    """
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def key(self, file_a, file_b, options=None):
+        return self.content_key([file_a, file_b], options)
+
+    def content_key(self, paths, options=None):
+        payload = json.dumps([[hash_file(p) for p in paths], options or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        """Returns the entry's meta dict (and marks it recently used), or None on a miss."""
+        meta_path = os.path.join(self.entry_dir(key), "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(self.entry_dir(key))
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def fetch(self, key, name, dest):
+        """Hard-links (or copies, across volumes) a stored file to dest. Returns False if absent."""
+        src = os.path.join(self.entry_dir(key), name)
+        if not os.path.exists(src): return False
+        if os.path.exists(dest): os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+        return True
+
+    def store(self, key, files, meta=None):
+        """Adds files ({stored_name: source_path}) to the entry for key, then evicts."""
+        entry = self.entry_dir(key)
+        os.makedirs(entry, exist_ok=True)
+        for name, src in files.items():
+            tmp = os.path.join(entry, f".{name}.{threading.get_ident()}.tmp")
+            shutil.copy2(src, tmp)
+            os.replace(tmp, os.path.join(entry, name))
+
+        meta_path = os.path.join(entry, "meta.json")
+        merged = {}
+        try:
+            with open(meta_path) as f: merged = json.load(f)
+        except (OSError, ValueError):
+            pass
+        merged.update(meta or {})
+        merged['files'] = sorted(set(merged.get('files', [])) | set(files))
+        merged['stored'] = time.time()
+        tmp = meta_path + f".{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f: json.dump(merged, f)
+        os.replace(tmp, meta_path)
+        self.evict(keep=key)
+
+    def entries(self):
+        """Returns [(key, size_bytes, last_used), ...] oldest first."""
+        result = []
+        if not os.path.isdir(self.root): return result
+        for shard in os.scandir(self.root):
+            if not shard.is_dir(): continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir(): continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                result.append((entry.name, size, entry.stat().st_mtime))
+        result.sort(key=lambda x: x[2])
+        return result
+
+    def evict(self, keep=None):
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for key, size, _ in entries:
+                if total <= self.max_bytes: break
+                if key == keep: continue
+                shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {'root': self.root, 'entries': len(entries), 'bytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+def run_cache_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --cache", description="Inspect or clear the redline or STEP mesh cache.")
+    parser.add_argument("action", choices=["info", "list", "clear"])
+    parser.add_argument("--store", choices=["redlines", "meshes"], default="redlines", help="Which cache to act on (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    cache = RedlineCache() if args.store == "redlines" else RedlineCache(MESH_CACHE_DIR, MESH_CACHE_MAX_BYTES)
+    if args.action == "clear":
+        cache.clear()
+        print(f"Cleared {cache.root}")
+    elif args.action == "list":
+        for key, size, last_used in cache.entries():
+            print(f"{key}  {size / 1024:>10.1f} KiB  {time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}")
+    else:
+        stats = cache.stats()
+        print(f"{stats['root']}: {stats['entries']} entries, {stats['bytes'] / 1024 ** 2:.1f} MiB of {stats['max_bytes'] / 1024 ** 2:.0f} MiB")
+    return 0
+
+# --- PDF DIFF ---
+def run_pdf_diff(file_a, file_b, output_path, on_start=None):
+    """
+    Runs diff-pdf once. Returns the CompletedProcess (returncode 0 = identical, 1 = differences).
+    on_start(proc) is called with the live Popen so callers can kill it.
+    """
+    cmd = [DIFF_PDF_COMMAND, f'--output-diff={os.path.normpath(output_path)}', os.path.normpath(file_b), os.path.normpath(file_a)]
+    with trace_span('diff_pdf.process', file=os.path.basename(file_b)) as span:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=DIFF_PDF_DIR, creationflags=SUBPROCESS_FLAGS)
+        if on_start: on_start(proc)
+        stdout, stderr = proc.communicate()
+        span['returncode'] = proc.returncode
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+# --- DIFF ENGINES ---
+class DiffEngine:
+    """
+    Turns two PDFs into a redline. diff() returns a CompletedProcess whose returncode follows
+    diff-pdf: 0 = identical, 1 = differences, anything else = failure. on_start(handle) receives
+    an object with poll()/kill() so the job queue can cancel it; engines that can, report
+    progress(pages_done, pages_total). When only some pages reach the engine,
+    run_pdf_diff_narrowed() adds the 1-based page of the whole document and its page count:
+    progress(pages_done, pages_total, page, pages).
+    """
+    name = None
+    requires = None # What to install when available() is False
+
+    def available(self):
+        return True
+
+    def options(self):
+        """Settings that change the output; folded into the cache key."""
+        return {'engine': self.name}
+
+    def diff(self, file_a, file_b, output_path, on_start=None, progress=None):
+        raise NotImplementedError
+
+class DiffPdfEngine(DiffEngine):
+    """The bundled diff-pdf executable."""
+    name = 'diff-pdf'
+    requires = f"diff-pdf.exe in {DIFF_PDF_DIR}"
+
+    def available(self):
+        return os.path.exists(DIFF_PDF_COMMAND)
+
+    def diff(self, file_a, file_b, output_path, on_start=None, progress=None):
+        return run_pdf_diff(file_a, file_b, output_path, on_start)
+
+# Per-process document handles for raster workers, so each page task doesn't reopen both files
+_raster_docs = {}
+_raster_page_keys = {} # path -> (page xrefs, {index: fingerprint}) for shared renders
+
+def _raster_open(path):
+    doc = _raster_docs.get(path)
+    if doc is None:
+        doc = _raster_docs[path] = pymupdf.open(path)
+    return doc
+
+def _raster_page_key(path, index):
+    """Fingerprint of one page of an open raster document; the page-xref set is built once per document."""
+    doc = _raster_open(path)
+    if path not in _raster_page_keys:
+        _raster_page_keys[path] = ({doc.page_xref(i) for i in range(len(doc))}, {})
+    xrefs, keys = _raster_page_keys[path]
+    if index not in keys:
+        keys[index] = page_fingerprint(doc, doc[index], xrefs)
+    return keys[index]
+
+def _render_page(doc, index, dpi):
+    pix = doc[index].get_pixmap(dpi=dpi, colorspace=pymupdf.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)[:, :, :3]
+
+def _shared_render(path, index, dpi, render_dir, timeout=120.0):
+    """
+    Renders a page through render_dir. Only pages announced with a "<fingerprint>.shared" marker
+    (see chain_shared_pages) are stored, as .npy files named by fingerprint: whichever process
+    claims the page first renders and stores it, and the other pair loads it and deletes it.
+    Any other page is rendered in place, so the store only ever holds renders still owed to a pair.
+    """
+    doc = _raster_open(path)
+    key = _raster_page_key(path, index)
+    marker = os.path.join(render_dir, f"{key}.shared")
+    if not os.path.exists(marker):
+        return _render_page(doc, index, dpi)
+    target = os.path.join(render_dir, f"{key}-{dpi}.npy")
+    claim = target + ".lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        if os.path.exists(target):
+            with trace_span('raster.render', page=index, shared=True):
+                try:
+                    arr = np.load(target)
+                except (OSError, ValueError):
+                    # A third reader (the same sheet repeated) lost the race with the delete below
+                    return _render_page(doc, index, dpi)
+            for done in (target, marker):
+                try: os.remove(done)
+                except OSError: pass
+            return arr
+        try:
+            fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Another worker is rendering it; give up waiting rather than hang on a dead one
+            if time.monotonic() > deadline: return _render_page(doc, index, dpi)
+            time.sleep(0.02)
+            continue
+        try:
+            # Stored, or stored and already consumed, between the check above and the claim
+            if os.path.exists(target): continue
+            if not os.path.exists(marker): return _render_page(doc, index, dpi)
+            with trace_span('raster.render', page=index, shared=False):
+                arr = _render_page(doc, index, dpi)
+            tmp = f"{target}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, target)
+            return arr
+        finally:
+            os.close(fd)
+            os.remove(claim)
+
+def _raster_page(path, index, dpi, shape, render_dir=None):
+    """Renders one page to an RGB array padded with white to shape (h, w)."""
+    doc = _raster_open(path)
+    img = np.full(shape + (3,), 255, dtype=np.uint8)
+    if index < len(doc):
+        arr = _shared_render(path, index, dpi, render_dir) if render_dir else _render_page(doc, index, dpi)
+        h, w = min(arr.shape[0], shape[0]), min(arr.shape[1], shape[1])
+        img[:h, :w] = arr[:h, :w]
+    return img
+
+def raster_diff_page(file_a, file_b, index, dpi, tolerance, render_dir=None):
+    """
+    Diffs one page. Returns (index, changed, flate_rgb, width_px, height_px, width_pt, height_pt).
+    Removed ink is drawn red, added ink blue, unchanged content faded grey.
+    """
+    with trace_span('raster.page', page=index):
+        result = _raster_diff_page(file_a, file_b, index, dpi, tolerance, render_dir)
+    # Pool workers end with os._exit, so nothing may stay buffered
+    flush_tracing()
+    return result
+
+def _raster_diff_page(file_a, file_b, index, dpi, tolerance, render_dir):
+    doc_a, doc_b = _raster_open(file_a), _raster_open(file_b)
+    pages = [d[index] for d in (doc_a, doc_b) if index < len(d)]
+    width_pt = max(p.rect.width for p in pages)
+    height_pt = max(p.rect.height for p in pages)
+    zoom = dpi / 72.0
+    shape = (int(round(height_pt * zoom)) + 1, int(round(width_pt * zoom)) + 1)
+
+    img_a = _raster_page(file_a, index, dpi, shape, render_dir)
+    img_b = _raster_page(file_b, index, dpi, shape, render_dir)
+
+    # Channel-wise ops on uint8 views; reductions over the short last axis are far slower
+    diff = np.maximum(img_a, img_b) - np.minimum(img_a, img_b)
+    delta = np.maximum(np.maximum(diff[:, :, 0], diff[:, :, 1]), diff[:, :, 2]) > tolerance
+    changed = bool(delta.any())
+
+    gray_a = np.minimum(np.minimum(img_a[:, :, 0], img_a[:, :, 1]), img_a[:, :, 2])
+    gray_b = np.minimum(np.minimum(img_b[:, :, 0], img_b[:, :, 1]), img_b[:, :, 2])
+    # Faded copy of the new page as the backdrop
+    out = (255 - (255 - np.minimum(gray_a, gray_b)) // 3).astype(np.uint8)
+    out = np.repeat(out[:, :, None], 3, axis=2)
+    if changed:
+        removed = delta & (gray_a < gray_b)
+        added = delta & (gray_b < gray_a)
+        out[removed] = (220, 30, 30)
+        out[added] = (30, 60, 220)
+
+    # Compressed here so only a fraction of the raster ever crosses back to the writer
+    data = zlib.compress(np.ascontiguousarray(out).tobytes(), 6)
+    return index, changed, data, shape[1], shape[0], width_pt, height_pt
+
+# Rough working set per rendered pixel: both renders, diff, masks, greys and the overlay
+RASTER_BYTES_PER_PIXEL = 20
+
+class StreamingPdfWriter:
+    """
+    Minimal PDF writer that appends one image page at a time straight to disk, so a redline of
+    any length never has to be assembled in memory. The page tree is written on close().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3 # 1 = Catalog, 2 = Pages
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % obj_id + body)
+        if stream is not None:
+            self.f.write(b"\nstream\n" + stream + b"\nendstream")
+        self.f.write(b"\nendobj\n")
+
+    def _allocate(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def add_image_page(self, flate_rgb, width_px, height_px, width_pt, height_pt):
+        image_id, content_id, page_id = self._allocate(), self._allocate(), self._allocate()
+        self._write_object(image_id, b"<</Type/XObject/Subtype/Image/Width %d/Height %d/ColorSpace/DeviceRGB"
+                                     b"/BitsPerComponent 8/Filter/FlateDecode/Length %d>>" % (width_px, height_px, len(flate_rgb)), flate_rgb)
+        content = b"q %.3f 0 0 %.3f 0 0 cm /Im0 Do Q" % (width_pt, height_pt)
+        self._write_object(content_id, b"<</Length %d>>" % len(content), content)
+        self._write_object(page_id, b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 %.3f %.3f]/Resources<</XObject<</Im0 %d 0 R>>>>"
+                                    b"/Contents %d 0 R>>" % (width_pt, height_pt, image_id, content_id))
+        self.page_ids.append(page_id)
+        self.f.flush()
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % i for i in self.page_ids)
+        self._write_object(2, b"<</Type/Pages/Kids[%s]/Count %d>>" % (kids, len(self.page_ids)))
+        self._write_object(1, b"<</Type/Catalog/Pages 2 0 R>>")
+        xref_pos = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_id)
+        for obj_id in range(1, self.next_id):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self.f.write(b"trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_pos))
+        self.f.close()
+
+    def abort(self):
+        """Closes and deletes the partial file; a truncated PDF must never be left at the output path."""
+        self.f.close()
+        try: os.remove(self.path)
+        except OSError: pass
+
+class RasterRun:
+    """poll()/kill() handle for an in-process raster diff, mirroring Popen for the job queue."""
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.cancelled.set()
+
+class RunHandle:
+    """
+    poll()/kill() proxy handed to on_start in place of the engine's own handle. It remembers a kill,
+    so a cancelled run is never mistaken for a result (a killed diff-pdf exits 1 on Windows).
+    """
+    def __init__(self, on_start=None):
+        self.on_start = on_start
+        self.proc = None
+        self.cancelled = threading.Event()
+
+    def attach(self, proc):
+        self.proc = proc
+        if self.on_start: self.on_start(self)
+
+    def poll(self):
+        return self.proc.poll() if self.proc else None
+
+    def kill(self):
+        self.cancelled.set()
+        if self.proc: self.proc.kill()
+
+class RasterDiffEngine(DiffEngine):
+    """
+    Pure-Python engine: PyMuPDF renders both files, NumPy compares pixels and composes the overlay.
+    Pages stream through a process pool in a window sized to max_memory_mb and are written to the
+    redline in order as they finish, so memory stays flat however long the document is.
+    With render_dir, page renders are shared between runs (see _shared_render).
+    """
+    name = 'raster'
+    requires = "PyMuPDF and NumPy (pip install pymupdf numpy)"
+
+    def __init__(self, dpi=RASTER_DPI, jobs=None, tolerance=RASTER_TOLERANCE, max_memory_mb=RASTER_MAX_MEMORY_MB, render_dir=None):
+        self.dpi = dpi
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.tolerance = tolerance
+        self.max_memory_mb = max_memory_mb
+        self.render_dir = render_dir
+
+    def available(self):
+        return pymupdf is not None and np is not None
+
+    def options(self):
+        return {'engine': self.name, 'dpi': self.dpi, 'tolerance': self.tolerance}
+
+    def window_size(self, file_a, file_b):
+        """Pages allowed in flight at once. Returns (window, page_count)."""
+        zoom = self.dpi / 72.0
+        largest = 1
+        page_count = 0
+        for path in (file_a, file_b):
+            with pymupdf.open(path) as doc:
+                page_count = max(page_count, len(doc))
+                for page in doc:
+                    largest = max(largest, page.rect.width * zoom * page.rect.height * zoom)
+        per_page = largest * RASTER_BYTES_PER_PIXEL
+        return max(1, int(self.max_memory_mb * 1024 * 1024 // per_page)), page_count
+
+    def diff(self, file_a, file_b, output_path, on_start=None, progress=None):
+        with trace_span('raster.diff', file=os.path.basename(file_b), dpi=self.dpi) as span:
+            result = self._diff(file_a, file_b, output_path, on_start, progress)
+            span['returncode'] = result.returncode
+            return result
+
+    def _diff(self, file_a, file_b, output_path, on_start, progress):
+        run = RasterRun()
+        if on_start: on_start(run)
+        writer = None
+        try:
+            window, page_count = self.window_size(file_a, file_b)
+            workers = max(1, min(self.jobs, window, page_count))
+            writer = StreamingPdfWriter(output_path)
+            any_changed = False
+
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                in_flight = {}
+                next_submit = 0
+                for index in range(page_count):
+                    # Keep the window full, but never further ahead than the memory budget allows
+                    while next_submit < page_count and next_submit < index + window:
+                        in_flight[next_submit] = pool.submit(raster_diff_page, file_a, file_b, next_submit, self.dpi, self.tolerance, self.render_dir)
+                        next_submit += 1
+                    if run.cancelled.is_set():
+                        for f in in_flight.values(): f.cancel()
+                        writer.abort()
+                        run.returncode = -9
+                        return subprocess.CompletedProcess([], -9, "", "cancelled")
+
+                    _, changed, data, width_px, height_px, width_pt, height_pt = in_flight.pop(index).result()
+                    writer.add_image_page(data, width_px, height_px, width_pt, height_pt)
+                    any_changed = any_changed or changed
+                    if progress: progress(index + 1, page_count)
+
+            writer.close()
+            run.returncode = 1 if any_changed else 0
+            return subprocess.CompletedProcess([], run.returncode, "", "")
+        except Exception as e:
+            if writer: writer.abort()
+            run.returncode = 2
+            return subprocess.CompletedProcess([], 2, "", f"Raster diff failed: {e}")
+
+DIFF_ENGINES = {
+    DiffPdfEngine.name: DiffPdfEngine,
+    RasterDiffEngine.name: RasterDiffEngine,
+}
+
+def get_diff_engine(name=None, **kwargs):
+    """
+    Builds the named engine; 'auto' picks diff-pdf when bundled, otherwise the raster engine.
+    The result may still be unavailable (see engine_unavailable()); diffs then fail with that message.
+    """
+    name = name or DEFAULT_DIFF_ENGINE
+    if name == 'auto':
+        name = DiffPdfEngine.name if DiffPdfEngine().available() else RasterDiffEngine.name
+    engine_cls = DIFF_ENGINES[name]
+    if engine_cls is RasterDiffEngine:
+        return engine_cls(**kwargs)
+    return engine_cls()
+
+def engine_unavailable(engine):
+    """None when engine can run, otherwise a message naming what is missing."""
+    if engine.available(): return None
+    if engine.name == RasterDiffEngine.name and not DiffPdfEngine().available():
+        return f"No diff engine available: needs {DiffPdfEngine.requires}, or {RasterDiffEngine.requires}."
+    return f"The '{engine.name}' diff engine needs {engine.requires}."
+
+# --- PAGE FINGERPRINTS (Skip or narrow diff-pdf work) ---
+_PDF_REF = re.compile(r'(\d+) \d+ R')
+# Back-references that would drag the whole page tree into one page's fingerprint
+_PDF_BACKREF = re.compile(r'/(Parent|P|Popup)\s+\d+ \d+ R')
+
+def _hash_pdf_object(doc, value, h, seen):
+    """Feeds a PDF object and everything it references into h, independent of xref numbering."""
+    value = _PDF_BACKREF.sub('', value)
+    h.update(_PDF_REF.sub('R', value).encode())
+    for match in _PDF_REF.finditer(value):
+        xref = int(match.group(1))
+        if xref in seen:
+            h.update(b'<seen>')
+            continue
+        seen.add(xref)
+        if doc.xref_is_stream(xref):
+            h.update(doc.xref_stream_raw(xref) or b'')
+        _hash_pdf_object(doc, doc.xref_object(xref, compressed=True), h, seen)
+
+def page_fingerprint(doc, page, page_xrefs):
+    """SHA-256 of one page over its geometry, content streams, annotations and every referenced resource."""
+    h = hashlib.sha256()
+    h.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+    # Links to other pages are recorded, not followed
+    seen = set(page_xrefs)
+    for key in ("Contents", "Resources", "Annots"):
+        xref = page.xref
+        kind, value = doc.xref_get_key(xref, key)
+        # Resources may be inherited from an ancestor Pages node
+        while key == "Resources" and kind == "null":
+            parent_kind, parent = doc.xref_get_key(xref, "Parent")
+            if parent_kind != "xref": break
+            xref = int(parent.split()[0])
+            kind, value = doc.xref_get_key(xref, key)
+        h.update(key.encode())
+        _hash_pdf_object(doc, value, h, seen)
+    return h.hexdigest()
+
+_fingerprints = OrderedDict()
+_fingerprints_lock = threading.Lock()
+
+def page_fingerprints(path):
+    """
+    Per-page fingerprints of a PDF, memoized on (path, size, mtime) like hash_file(). Only the
+    FINGERPRINT_MEMO_FILES most recently used documents are kept, since --watch and --serve see
+    an unbounded stream of revisions.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _fingerprints_lock:
+        if memo_key in _fingerprints:
+            _fingerprints.move_to_end(memo_key)
+            return _fingerprints[memo_key]
+    with trace_span('fingerprint', file=os.path.basename(path)):
+        fingerprints = _page_fingerprints(path)
+    with _fingerprints_lock:
+        _fingerprints[memo_key] = fingerprints
+        while len(_fingerprints) > FINGERPRINT_MEMO_FILES:
+            _fingerprints.popitem(last=False)
+    return fingerprints
+
+def _page_fingerprints(path):
+    doc = pymupdf.open(path)
+    try:
+        page_xrefs = {page.xref for page in doc}
+        return [page_fingerprint(doc, page, page_xrefs) for page in doc]
+    finally:
+        doc.close()
+
+def page_ranges(pages):
+    """Collapses sorted page indices into inclusive (first, last) runs."""
+    ranges = []
+    for p in pages:
+        if ranges and ranges[-1][1] == p - 1: ranges[-1][1] = p
+        else: ranges.append([p, p])
+    return [tuple(r) for r in ranges]
+
+def extract_pages(src_path, ranges, dest_path):
+    src = pymupdf.open(src_path)
+    out = pymupdf.open()
+    try:
+        for first, last in ranges:
+            out.insert_pdf(src, from_page=first, to_page=last)
+        out.save(dest_path)
+    finally:
+        out.close()
+        src.close()
+
+# --- TEXT-LAYER TRIAGE (Fast change report) ---
+def page_words(path):
+    """Per page, the words of the text layer in reading order as (x0, y0, x1, y1, word) tuples."""
+    with trace_span('text_layer', file=os.path.basename(path)):
+        doc = pymupdf.open(path)
+        try:
+            return [[w[:5] for w in page.get_text("words", sort=True)] for page in doc]
+        finally:
+            doc.close()
+
+def word_boxes(words):
+    """Merges words into one box per run on the same line; returns [[x0, y0, x1, y1], ...]."""
+    boxes = []
+    for x0, y0, x1, y1, _ in words:
+        if boxes:
+            b = boxes[-1]
+            height = max(y1 - y0, b[3] - b[1], 1)
+            overlap = min(y1, b[3]) - max(y0, b[1])
+            if overlap > 0.5 * height and -height < x0 - b[2] < 3 * height:
+                b[:] = [min(b[0], x0), min(b[1], y0), max(b[2], x1), max(b[3], y1)]
+                continue
+        boxes.append([x0, y0, x1, y1])
+    return [[round(v, 1) for v in b] for b in boxes]
+
+def diff_page_words(words_a, words_b):
+    """Word-sequence diff of one page pair. Returns a list of change dicts (empty when the text matches)."""
+    text_a, text_b = [w[4] for w in words_a], [w[4] for w in words_b]
+    if text_a == text_b:
+        return []
+    changes = []
+    matcher = difflib.SequenceMatcher(None, text_a, text_b, autojunk=False)
+    for op, a1, a2, b1, b2 in matcher.get_opcodes():
+        if op == 'equal': continue
+        changes.append({
+            'op': op,
+            'old': " ".join(text_a[a1:a2]),
+            'new': " ".join(text_b[b1:b2]),
+            'boxes_a': word_boxes(words_a[a1:a2]),
+            'boxes_b': word_boxes(words_b[b1:b2]),
+        })
+    return changes
+
+def align_pages(words_a, words_b):
+    """Pairs pages of A and B: index-wise when the counts match, else by a sequence diff of page texts."""
+    if len(words_a) == len(words_b):
+        return list(zip(range(len(words_a)), range(len(words_b))))
+    digests_a = [hash(tuple(w[4] for w in page)) for page in words_a]
+    digests_b = [hash(tuple(w[4] for w in page)) for page in words_b]
+    pairs = []
+    for op, a1, a2, b1, b2 in difflib.SequenceMatcher(None, digests_a, digests_b, autojunk=False).get_opcodes():
+        common = min(a2 - a1, b2 - b1) if op in ('equal', 'replace') else 0
+        pairs.extend((a1 + i, b1 + i) for i in range(common))
+        pairs.extend((a, None) for a in range(a1 + common, a2))
+        pairs.extend((None, b) for b in range(b1 + common, b2))
+    return pairs
+
+def text_diff(file_a, file_b):
+    """
+    Compares the text layers of two PDFs. Returns a report dict listing every page that was
+    changed, added or removed with the changed words and their boxes (PDF points, top-left origin).
+    Pages without any text on either side are listed as 'no-text': the text layer cannot vouch for them.
+    """
+    with trace_span('text_diff', file=os.path.basename(file_b)) as span:
+        start = time.perf_counter()
+        words_a, words_b = page_words(file_a), page_words(file_b)
+        pages = []
+        for a, b in align_pages(words_a, words_b):
+            entry = {'page_a': a, 'page_b': b}
+            if a is None: entry['status'] = 'added'
+            elif b is None: entry['status'] = 'removed'
+            elif not words_a[a] and not words_b[b]: entry['status'] = 'no-text'
+            else:
+                changes = diff_page_words(words_a[a], words_b[b])
+                if not changes: continue
+                entry.update(status='changed', changes=changes)
+            pages.append(entry)
+        span['pages'] = len(words_b)
+        return {
+            'file_a': file_a,
+            'file_b': file_b,
+            'pages_a': len(words_a),
+            'pages_b': len(words_b),
+            'changed': sum(1 for p in pages if p['status'] != 'no-text'),
+            'seconds': round(time.perf_counter() - start, 3),
+            'pages': pages,
+        }
+
+def text_gate_pages(report):
+    """Pages of file_b (0-based) that still need a raster comparison according to a text_diff() report."""
+    return sorted(p['page_b'] for p in report['pages'] if p['page_b'] is not None)
+
+def write_text_report_html(report, path):
+    """Writes a text_diff() report as a standalone HTML page."""
+    esc = html.escape
+    rows = []
+    for p in report['pages']:
+        label = " / ".join(f"{side} p{p[key] + 1}" for side, key in (("A", 'page_a'), ("B", 'page_b')) if p[key] is not None)
+        changes = p.get('changes', [])
+        detail = "".join(f"<div class='{c['op']}'><del>{esc(c['old'])}</del> <ins>{esc(c['new'])}</ins>"
+                         f" <small>{esc(str(c['boxes_b'] or c['boxes_a']))}</small></div>" for c in changes)
+        rows.append(f"<tr><td>{label}</td><td>{p['status']}</td><td>{detail}</td></tr>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Text changes: {esc(os.path.basename(report['file_b']))}</title>
+<style>
+body {{ font-family: 'Segoe UI', sans-serif; font-size: 13px; }}
+table {{ border-collapse: collapse; }} td, th {{ border: 1px solid #ccc; padding: 4px 8px; vertical-align: top; }}
+del {{ background: #fdd; }} ins {{ background: #dfd; text-decoration: none; }} small {{ color: #888; }}
+</style></head><body>
+<h3>{esc(report['file_a'])} &rarr; {esc(report['file_b'])}</h3>
+<p>{report['changed']} page(s) changed; {report['pages_a']} &rarr; {report['pages_b']} pages; {report['seconds']}s</p>
+<table><tr><th>Page</th><th>Status</th><th>Changes</th></tr>
+{"".join(rows)}
+</table></body></html>
+""")
+
+def run_text_diff_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --text-diff", description="Fast text-layer comparison with a JSON/HTML change report.")
+    parser.add_argument("file_a", help="Older revision")
+    parser.add_argument("file_b", help="Newer revision")
+    parser.add_argument("--json", help="Write the report as JSON (default: print it)")
+    parser.add_argument("--html", help="Also write the report as HTML")
+    parser.add_argument("--redline", nargs="?", const="", help="Raster-diff only the pages with text changes into this PDF (default: <file_b>-Redline.pdf)")
+    parser.add_argument("--engine", choices=['auto'] + sorted(DIFF_ENGINES), default=DEFAULT_DIFF_ENGINE, help="Diff engine for --redline (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the redline cache for --redline")
+    args = parser.parse_args(argv)
+    if not pymupdf:
+        parser.error("PyMuPDF is required for text-layer comparison")
+
+    report = text_diff(args.file_a, args.file_b)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.html:
+        write_text_report_html(report, args.html)
+    if not args.json:
+        print(json.dumps(report, indent=2))
+
+    if args.redline is not None:
+        output_path = args.redline or os.path.join(os.path.dirname(args.file_b), default_redline_name(args.file_b))
+        res, hit = run_pdf_diff_cached(args.file_a, args.file_b, output_path, None if args.no_cache else RedlineCache(),
+                                       engine=get_diff_engine(args.engine), text_gate=True)
+        if res.returncode not in [0, 1]:
+            sys.stderr.write(res.stderr)
+            return 2
+        print(f"{output_path}: {res.stdout or 'done'}{' (cached)' if hit else ''}", file=sys.stderr)
+    # Exit like diff-pdf: 0 = no text changes, 1 = changes
+    return 1 if report['changed'] else 0
+
+def diff_options(engine, text_gate=False):
+    """Everything that shapes a redline, as folded into cache and de-duplication keys."""
+    return dict(PDF_DIFF_OPTIONS, text_gate=text_gate, **engine.options())
+
+def run_pdf_diff_narrowed(file_a, file_b, output_path, on_start=None, engine=None, progress=None, text_gate=False):
+    """
+    Runs engine (diff-pdf by default) behind a fingerprint pre-pass. Identical files never reach
+    the engine; otherwise only the changed pages are rasterized and the redline is stitched from those results plus the
+    untouched pages of file_b. Falls back to a whole-file diff when PyMuPDF is missing or the
+    page counts differ.
+    With text_gate, changed pages whose text layer is unchanged are not rasterized (they appear
+    unmarked in the redline); they still count as differences and are listed in res.gated_pages.
+    The redline is written beside output_path and swapped in, so output_path is never written
+    through: it may be a hard link into the RedlineCache from an earlier hit. A run that leaves
+    no redline (failed or cancelled) removes any stale output_path.
+    """
+    out_dir, name = os.path.split(output_path)
+    tmp_path = os.path.join(out_dir, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        res = _run_pdf_diff_narrowed(file_a, file_b, tmp_path, on_start, engine, progress, text_gate)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, output_path)
+        elif os.path.exists(output_path):
+            os.remove(output_path)
+        return res
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def _run_pdf_diff_narrowed(file_a, file_b, output_path, on_start, engine, progress, text_gate):
+    engine = engine or DiffPdfEngine()
+    run = RunHandle(on_start)
+
+    def engine_diff(a, b, out, progress=progress):
+        missing = engine_unavailable(engine)
+        if missing:
+            return subprocess.CompletedProcess([], 2, "", missing)
+        res = engine.diff(a, b, out, run.attach, progress)
+        if run.cancelled.is_set():
+            # Whatever the killed engine left behind is partial
+            if os.path.exists(out): os.remove(out)
+            return subprocess.CompletedProcess(res.args, -9, res.stdout, "cancelled")
+        return res
+
+    if hash_file(file_a) == hash_file(file_b):
+        shutil.copyfile(file_b, output_path)
+        return subprocess.CompletedProcess([], 0, "identical files", "")
+
+    if not pymupdf:
+        return engine_diff(file_a, file_b, output_path)
+
+    try:
+        prints_a, prints_b = page_fingerprints(file_a), page_fingerprints(file_b)
+    except Exception as e:
+        log_debug(f"FINGERPRINT ERROR: {e}")
+        return engine_diff(file_a, file_b, output_path)
+
+    if len(prints_a) != len(prints_b):
+        return engine_diff(file_a, file_b, output_path)
+
+    changed = [i for i, (a, b) in enumerate(zip(prints_a, prints_b)) if a != b]
+    gated_out = []
+    if changed and text_gate:
+        try:
+            keep = set(text_gate_pages(text_diff(file_a, file_b)))
+            gated_out = [i for i in changed if i not in keep]
+            changed = [i for i in changed if i in keep]
+        except Exception as e:
+            log_debug(f"TEXT GATE ERROR: {e}")
+    if not changed:
+        shutil.copyfile(file_b, output_path)
+        if gated_out:
+            res = subprocess.CompletedProcess([], 1, f"{len(gated_out)} page(s) changed outside the text layer (not rasterized)", "")
+            res.gated_pages = gated_out
+            return res
+        # Only metadata or document structure differs
+        return subprocess.CompletedProcess([], 0, "identical pages", "")
+    if len(changed) == len(prints_b):
+        return engine_diff(file_a, file_b, output_path)
+
+    ranges = page_ranges(changed)
+    with tempfile.TemporaryDirectory(prefix="diffpdf-") as tmp:
+        part_a, part_b, part_out = (os.path.join(tmp, n) for n in ("a.pdf", "b.pdf", "diff.pdf"))
+        extract_pages(file_a, ranges, part_a)
+        extract_pages(file_b, ranges, part_b)
+
+        def subset_progress(done, total):
+            # Report against the whole document, not the extracted subset
+            progress(done, total, changed[done - 1] + 1, len(prints_b))
+
+        # One engine run over all changed pages keeps the spawn cost to a single process
+        res = engine_diff(part_a, part_b, part_out, subset_progress if progress else None)
+        if res.returncode not in [0, 1]:
+            return res
+
+        src_b = pymupdf.open(file_b)
+        diff_doc = pymupdf.open(part_out) if os.path.exists(part_out) else None
+        out = pymupdf.open()
+        try:
+            next_diff_page = 0
+            cursor = 0
+            for first, last in ranges:
+                if first > cursor:
+                    out.insert_pdf(src_b, from_page=cursor, to_page=first - 1)
+                count = last - first + 1
+                if diff_doc is not None and next_diff_page + count <= len(diff_doc):
+                    out.insert_pdf(diff_doc, from_page=next_diff_page, to_page=next_diff_page + count - 1)
+                else:
+                    out.insert_pdf(src_b, from_page=first, to_page=last)
+                next_diff_page += count
+                cursor = last + 1
+            if cursor < len(src_b):
+                out.insert_pdf(src_b, from_page=cursor, to_page=len(src_b) - 1)
+            out.save(output_path, garbage=3, deflate=True)
+        finally:
+            out.close()
+            if diff_doc is not None: diff_doc.close()
+            src_b.close()
+
+    res.stdout = f"compared {len(changed)} of {len(prints_b)} pages"
+    if gated_out:
+        res.returncode = 1
+        res.gated_pages = gated_out
+        res.stdout += f", {len(gated_out)} changed outside the text layer (not rasterized)"
+    return res
+
+def run_pdf_diff_cached(file_a, file_b, output_path, cache=None, on_start=None, engine=None, progress=None, text_gate=False):
+    """run_pdf_diff_narrowed behind the RedlineCache. Returns (CompletedProcess, cache_hit)."""
+    with trace_span('compare', file=os.path.basename(file_b)) as span:
+        res, span['cached'] = _run_pdf_diff_cached(file_a, file_b, output_path, cache, on_start, engine, progress, text_gate)
+        span['returncode'] = res.returncode
+        return res, span['cached']
+
+def _run_pdf_diff_cached(file_a, file_b, output_path, cache, on_start, engine, progress, text_gate):
+    engine = engine or get_diff_engine()
+    key = None
+    if cache:
+        try:
+            key = cache.key(file_a, file_b, diff_options(engine, text_gate))
+            meta = cache.lookup(key)
+            if meta and all(cache.fetch(key, name, output_path) for name in meta['files']):
+                res = subprocess.CompletedProcess([], meta['returncode'], "", "")
+                if meta.get('gated_pages'): res.gated_pages = meta['gated_pages']
+                return res, True
+        except Exception as e:
+            log_debug(f"CACHE ERROR: {e}")
+
+    res = run_pdf_diff_narrowed(file_a, file_b, output_path, on_start, engine, progress, text_gate)
+    # Only successful runs are cached (a cancelled run comes back as -9); identical inputs may legitimately produce no file
+    if key and res.returncode in [0, 1]:
+        try:
+            files = {'redline.pdf': output_path} if os.path.exists(output_path) else {}
+            cache.store(key, files, {'returncode': res.returncode, 'gated_pages': getattr(res, 'gated_pages', [])})
+        except Exception as e:
+            log_debug(f"CACHE ERROR: {e}")
+    return res, False
+
+# --- BATCH MODE (Headless) ---
+def find_revision_pairs(root_dir):
+    """
+    Walks root_dir and pairs every revisioned PDF with its next revision,
+    using the same prefix/number rules as the GUI auto-fill. Returns [(file_a, file_b), ...].
+    """
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        index = get_revision_index(dirpath)
+        for (ext, prefix) in sorted(index.groups):
+            if ext != '.pdf': continue
+            revisions = index.groups[(ext, prefix)]
+            for rev, f in revisions:
+                # Smallest revision > current, as in on_path_change(mode="next")
+                newer = [x for x in revisions if x[0] > rev]
+                if newer:
+                    pairs.append((os.path.join(dirpath, f), os.path.join(dirpath, newer[0][1])))
+    return pairs
+
+def run_batch_pair(file_a, file_b, output_dir=None, cache=None, engine=None, workers_3d=None, text_gate=False):
+    """Diffs one pair for batch mode (plus headless 3D views when workers_3d is given) and returns its summary record."""
+    out_dir = output_dir or os.path.dirname(file_b)
+    output_path = os.path.join(out_dir, default_redline_name(file_b))
+    record = {'file_a': file_a, 'file_b': file_b, 'output': output_path, 'returncode': None, 'status': 'error', 'cached': False, 'seconds': 0.0}
+    start = time.perf_counter()
+    try:
+        res, record['cached'] = run_pdf_diff_cached(file_a, file_b, output_path, cache, engine=engine, text_gate=text_gate)
+        record['returncode'] = res.returncode
+        if getattr(res, 'gated_pages', None): record['gated_pages'] = res.gated_pages
+        if res.returncode == 0: record['status'] = 'identical'
+        elif res.returncode == 1: record['status'] = 'different'
+        else: record['error'] = res.stderr.strip()
+    except Exception as e:
+        record['error'] = str(e)
+
+    step_a, step_b = find_step_file(file_a), find_step_file(file_b)
+    if workers_3d and step_a and step_b:
+        result = workers_3d.run({'step_a': step_a, 'step_b': step_b, 'prefix': view_image_prefix(output_path),
+                                 'views': list(DIFF3D_VIEWS), 'size': list(DIFF3D_VIEW_SIZE)})
+        record['3d'] = {'ok': result.get('ok', False), 'images': result.get('images', []), 'error': result.get('error')}
+
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+def run_batch(root_dir, output_dir=None, jobs=None, summary_path=None, progress=None, cache=None, engine=None, workers_3d=None, text_gate=False):
+    """Diffs every revision pair under root_dir on a bounded thread pool. Returns the summary dict."""
+    pairs = find_revision_pairs(root_dir)
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    engine = engine or get_diff_engine()
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    results = []
+    # diff-pdf does the heavy lifting in its own process, so threads are enough here
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_batch_pair, a, b, output_dir, cache, engine, workers_3d, text_gate) for a, b in pairs]
+        for i, future in enumerate(futures, 1):
+            results.append(future.result())
+            if progress: progress(i, len(futures), results[-1])
+
+    summary = {
+        'root': os.path.abspath(root_dir),
+        'jobs': jobs,
+        'engine': engine.options(),
+        'text_gate': text_gate,
+        'pairs': len(results),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'cached': sum(1 for r in results if r['cached']),
+        'seconds': round(time.perf_counter() - start, 3),
+        'results': results,
+    }
+    if summary_path:
+        with open(summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+def add_pipeline_args(parser, outputs=True, render_3d=True):
+    """Options shared by the headless modes (batch, chain, watch, serve) for how each pair is processed."""
+    if outputs:
+        parser.add_argument("--output-dir", help="Write redlines here instead of next to each newer revision")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of concurrent comparisons (default: CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="Always run diff-pdf, ignoring the redline cache")
+    parser.add_argument("--engine", choices=['auto'] + sorted(DIFF_ENGINES), default=DEFAULT_DIFF_ENGINE, help="Diff engine (default: %(default)s)")
+    parser.add_argument("--dpi", type=int, default=RASTER_DPI, help="Render resolution for the raster engine (default: %(default)s)")
+    if render_3d:
+        parser.add_argument("--3d", dest="render_3d", action="store_true", help="Also render headless 3D views for pairs with matching STEP files")
+        parser.add_argument("--3d-workers", dest="workers_3d", type=int, default=DIFF3D_WORKERS, help="Warm 3D worker processes (default: %(default)s)")
+    parser.add_argument("--max-memory", type=int, default=RASTER_MAX_MEMORY_MB, help="Raster engine memory ceiling per pair in MB (default: %(default)s)")
+    parser.add_argument("--text-gate", action="store_true", help="Only raster pages whose text layer changed (misses geometry-only edits)")
+
+def build_pipeline(args):
+    """Returns (cache, engine, workers_3d) for parsed add_pipeline_args() options."""
+    cache = None if args.no_cache else RedlineCache()
+    # Pairs already run concurrently, so the raster engine gets one process per pair
+    engine = get_diff_engine(args.engine, dpi=args.dpi, jobs=1, max_memory_mb=args.max_memory)
+    workers_3d = Diff3DWorkerPool(args.workers_3d, headless=True) if getattr(args, 'render_3d', False) else None
+    return cache, engine, workers_3d
+
+def run_batch_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --batch", description="Redline every revision pair found under a directory tree.")
+    parser.add_argument("root", help="Directory to scan for revisioned PDFs")
+    parser.add_argument("--summary", default=None, help="JSON summary path (default: <root>/redline_summary.json)")
+    add_pipeline_args(parser)
+    args = parser.parse_args(argv)
+
+    summary_path = args.summary or os.path.join(args.root, "redline_summary.json")
+
+    def progress(done, total, record):
+        tag = " (cached)" if record['cached'] else ""
+        print(f"[{done}/{total}] {record['status']:<9} {record['seconds']:>7.2f}s  {os.path.basename(record['file_b'])}{tag}")
+
+    cache, engine, workers_3d = build_pipeline(args)
+    try:
+        summary = run_batch(args.root, args.output_dir, args.jobs, summary_path, progress, cache, engine, workers_3d, args.text_gate)
+    finally:
+        if workers_3d: workers_3d.close()
+    print(f"{summary['pairs']} pairs ({summary['cached']} cached), {summary['failed']} failed, {summary['seconds']:.1f}s. Summary: {summary_path}")
+    return 1 if summary['failed'] else 0
+
+# --- CHAIN MODE (Rev1 -> Rev2 -> ... -> RevN) ---
+def find_revision_series(path):
+    """Every revision of path's drawing in its directory, oldest first (redlines excluded)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    name_no_ext, ext = os.path.splitext(os.path.basename(path))
+    rev_info = extract_revision(name_no_ext)
+    if not rev_info: return [path]
+    group = get_revision_index(directory).groups.get((ext.lower(), rev_info[0].lower()), [])
+    return [os.path.join(directory, f) for rev, f in group]
+
+def default_chain_name(files):
+    """Combined redline for a series, named after its newest revision."""
+    base_name = os.path.splitext(os.path.basename(files[-1]))[0]
+    return f"{base_name}-Chain-Redline.pdf"
+
+def write_chain_pdf(records, output_path):
+    """Concatenates the step redlines into one PDF with a bookmark per step."""
+    out = pymupdf.open()
+    toc = []
+    try:
+        for r in records:
+            if r['status'] == 'error' or not os.path.exists(r['output']): continue
+            toc.append([1, f"{os.path.basename(r['file_a'])} \u2192 {os.path.basename(r['file_b'])}", len(out) + 1])
+            with pymupdf.open(r['output']) as doc:
+                out.insert_pdf(doc)
+        if not toc: return False
+        out.set_toc(toc)
+        out.save(output_path, garbage=3, deflate=True)
+        return True
+    finally:
+        out.close()
+
+def chain_shared_pages(files):
+    """
+    Fingerprints of middle-revision pages that both of their pairs will rasterize: pages that
+    changed on the way in and again on the way out (every page, for a pair whose page counts differ).
+    """
+    prints = [page_fingerprints(f) for f in files]
+
+    def rendered(prints_a, prints_b):
+        if len(prints_a) != len(prints_b): return set(prints_a), set(prints_b)
+        changed = [i for i, (a, b) in enumerate(zip(prints_a, prints_b)) if a != b]
+        return {prints_a[i] for i in changed}, {prints_b[i] for i in changed}
+
+    sides = [rendered(a, b) for a, b in zip(prints, prints[1:])]
+    shared = set()
+    for (_, as_new), (as_old, _) in zip(sides, sides[1:]):
+        shared |= as_new & as_old
+    return shared
+
+def run_chain(files, output_dir=None, jobs=None, cache=None, engine=None, report_path=None, combined_path=None, progress=None,
+              workers_3d=None, text_gate=False):
+    """
+    Redlines each adjacent pair of files (oldest first) in parallel and returns a combined report.
+    Every revision is hashed and fingerprinted once. With the raster engine, all pairs render through
+    one shared store, so a middle revision's pages are rasterized once for both of its comparisons.
+    """
+    pairs = list(zip(files, files[1:]))
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(pairs) or 1))
+    engine = engine or get_diff_engine()
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="diffpdf-chain-") as render_dir, ThreadPoolExecutor(max_workers=jobs) as pool:
+        if pymupdf:
+            # Warm the per-file memos up front so no two pairs redo the same revision
+            list(pool.map(page_fingerprints, files))
+        if isinstance(engine, RasterDiffEngine):
+            for key in (chain_shared_pages(files) if pymupdf else ()):
+                open(os.path.join(render_dir, f"{key}.shared"), "w").close()
+            engine = RasterDiffEngine(engine.dpi, max(1, engine.jobs // jobs), engine.tolerance, engine.max_memory_mb, render_dir)
+
+        with trace_span('chain', revisions=len(files)):
+            futures = [pool.submit(run_batch_pair, a, b, output_dir, cache, engine, workers_3d, text_gate) for a, b in pairs]
+            records = []
+            for i, future in enumerate(futures, 1):
+                records.append(future.result())
+                if progress: progress(i, len(futures), records[-1])
+
+    report = {
+        'revisions': files,
+        'engine': engine.options(),
+        'text_gate': text_gate,
+        'pairs': len(records),
+        'changed': sum(1 for r in records if r['status'] == 'different'),
+        'failed': sum(1 for r in records if r['status'] == 'error'),
+        'seconds': round(time.perf_counter() - start, 3),
+        'steps': records,
+    }
+    if combined_path and pymupdf and records:
+        report['combined'] = combined_path if write_chain_pdf(records, combined_path) else None
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def run_chain_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --chain", description="Redline a whole revision series: Rev1 -> Rev2 -> ... -> RevN.")
+    parser.add_argument("files", nargs="+", help="One revision (its series is found by name) or the revisions to chain, oldest first")
+    parser.add_argument("--report", default=None, help="JSON report path (default: <output>/<newest>-Chain.json)")
+    parser.add_argument("--combined", default=None, help="Combined redline PDF (default: <output>/<newest>-Chain-Redline.pdf)")
+    add_pipeline_args(parser)
+    args = parser.parse_args(argv)
+
+    files = find_revision_series(args.files[0]) if len(args.files) == 1 else args.files
+    if len(files) < 2:
+        parser.error(f"no other revisions of {os.path.basename(args.files[0])} found")
+    out_dir = args.output_dir or os.path.dirname(os.path.abspath(files[-1]))
+    combined_path = args.combined or os.path.join(out_dir, default_chain_name(files))
+    report_path = args.report or os.path.join(out_dir, os.path.splitext(os.path.basename(files[-1]))[0] + "-Chain.json")
+
+    def progress(done, total, record):
+        print(f"[{done}/{total}] {record['status']:<9} {os.path.basename(record['file_a'])} -> {os.path.basename(record['file_b'])} ({record['seconds']:.1f}s)")
+
+    cache, engine, workers_3d = build_pipeline(args)
+    try:
+        report = run_chain(files, args.output_dir, args.jobs, cache, engine, report_path, combined_path, progress, workers_3d, args.text_gate)
+    finally:
+        if workers_3d: workers_3d.close()
+    print(f"{report['pairs']} step(s), {report['changed']} changed, {report['failed']} failed in {report['seconds']:.1f}s. Report: {report_path}")
+    if report.get('combined'): print(f"Combined redline: {report['combined']}")
+    return 1 if report['failed'] else 0
+
+# --- WATCH MODE (Daemon) ---
+try:
+    from watchdog.observers import Observer as WatchdogObserver
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    WatchdogObserver = None
+    FileSystemEventHandler = object
+
+WATCH_STATE = os.path.join(APP_DIR, 'watch_state.json')
+
+def is_watch_candidate(path):
+    return os.path.splitext(path)[1].lower() == '.pdf' and not is_redline(path)
+
+class _WatchEvents(FileSystemEventHandler):
+    """Forwards watchdog (inotify / ReadDirectoryChangesW) events to RedlineWatcher.touch()."""
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory: self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory: self.watcher.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory: self.watcher.touch(event.dest_path)
+
+class RedlineWatcher:
+    """
+    Watches directories for new revisions and redlines each against its predecessor.
+    A file is only picked up once its size and mtime have been stable for `settle` seconds and it
+    can be opened, so half-copied drops are skipped. Outcomes are persisted to the state file keyed
+    on (size, mtime), so a restart never redoes finished work but does catch up on missed files.
+    """
+    def __init__(self, roots, state_path=WATCH_STATE, settle=5.0, poll=10.0, jobs=None, output_dir=None,
+                 cache=None, engine=None, workers_3d=None, backfill=False, log=print, text_gate=False):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.state_path = state_path
+        self.settle = settle
+        self.poll = poll
+        self.output_dir = output_dir
+        self.cache = cache
+        self.engine = engine or get_diff_engine()
+        self.workers_3d = workers_3d
+        self.text_gate = text_gate
+        self.log = log
+        self.pool = ThreadPoolExecutor(max_workers=max(1, jobs or os.cpu_count() or 1))
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.pending = {}   # path -> (size, mtime_ns, last_change)
+        self.running = set()
+        self.snapshot = {}  # path -> (size, mtime_ns), for the polling fallback
+        self.observer = None
+
+        first_run = not os.path.exists(state_path)
+        self.state = self.load_state()
+        # On the very first run existing files are the baseline, not a backlog (unless asked)
+        for path, sig in self.scan().items():
+            if first_run and not backfill:
+                self.state.setdefault(path, {'size': sig[0], 'mtime_ns': sig[1], 'status': 'baseline'})
+            else:
+                self.touch(path)
+        self.snapshot = self.scan()
+        if first_run: self.save_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        # Pool threads save concurrently; one writer at a time owns the temp file until it is replaced
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.state, indent=1)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.state_path)
+
+    def scan(self):
+        """Returns {path: (size, mtime_ns)} for every candidate PDF under the roots."""
+        found = {}
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                for f in filenames:
+                    path = os.path.join(dirpath, f)
+                    if not is_watch_candidate(path): continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (st.st_size, st.st_mtime_ns)
+        return found
+
+    def touch(self, path):
+        """Notes that path appeared or changed; it is processed once it settles."""
+        path = os.path.abspath(path)
+        if not is_watch_candidate(path): return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            prev = self.pending.get(path)
+            if prev is None or prev[:2] != (st.st_size, st.st_mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def is_done(self, path, size, mtime_ns):
+        entry = self.state.get(path)
+        return bool(entry) and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns
+
+    def check_pending(self):
+        """Dispatches settled files to the pool."""
+        now = time.monotonic()
+        with self.lock:
+            items = list(self.pending.items())
+        for path, (size, mtime_ns, last_change) in items:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self.lock: self.pending.pop(path, None)
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.touch(path)
+                continue
+            if now - last_change < self.settle or path in self.running:
+                continue
+            if not self.is_readable(path):
+                continue
+            # Rev2 and Rev3 landing together: Rev3 waits until Rev2 has settled too
+            file_a = self.predecessor(path)
+            if file_a and not self.is_settled(file_a):
+                self.touch(file_a)
+                continue
+            with self.lock:
+                if file_a in self.pending or file_a in self.running: continue
+                self.pending.pop(path, None)
+                if self.is_done(path, size, mtime_ns): continue
+                self.running.add(path)
+            self.pool.submit(self.process, path, size, mtime_ns, file_a)
+
+    @staticmethod
+    def is_readable(path):
+        try:
+            # Writers on Windows hold the file locked until the copy completes
+            with open(path, "rb"): pass
+            return True
+        except OSError:
+            return False
+
+    def is_settled(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime >= self.settle and self.is_readable(path)
+        except OSError:
+            return False
+
+    @staticmethod
+    def predecessor(path):
+        """Full path of the previous revision of path, or None."""
+        if not extract_revision(os.path.splitext(os.path.basename(path))[0]): return None
+        match = find_revision_match(path, "prev")
+        return os.path.join(os.path.dirname(path), match) if match else None
+
+    def process(self, path, size, mtime_ns, file_a):
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'processed': time.time()}
+        try:
+            if not file_a:
+                entry['status'] = 'no-predecessor'
+                self.log(f"- {os.path.basename(path)}: no earlier revision")
+            else:
+                record = run_batch_pair(file_a, path, self.output_dir, self.cache, self.engine, self.workers_3d, self.text_gate)
+                entry.update(record)
+                self.log(f"+ {os.path.basename(path)} vs {os.path.basename(file_a)}: {record['status']} ({record['seconds']:.1f}s)")
+        except Exception as e:
+            entry.update(status='error', error=str(e))
+            self.log(f"! {os.path.basename(path)}: {e}")
+        finally:
+            with self.lock:
+                self.state[path] = entry
+                self.running.discard(path)
+            self.save_state()
+
+    def poll_changes(self):
+        """Polling fallback: diff a fresh scan against the last one."""
+        current = self.scan()
+        for path, sig in current.items():
+            if self.snapshot.get(path) != sig: self.touch(path)
+        self.snapshot = current
+
+    def run(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        if WatchdogObserver:
+            self.observer = WatchdogObserver()
+            handler = _WatchEvents(self)
+            for root in self.roots:
+                self.observer.schedule(handler, root, recursive=True)
+            self.observer.start()
+            self.log(f"Watching {len(self.roots)} folder(s) with filesystem events.")
+        else:
+            self.log(f"Watching {len(self.roots)} folder(s) by polling every {self.poll:g}s (pip install watchdog for events).")
+
+        last_poll = time.monotonic()
+        try:
+            while not stop_event.wait(1.0):
+                if not self.observer and time.monotonic() - last_poll >= self.poll:
+                    self.poll_changes()
+                    last_poll = time.monotonic()
+                self.check_pending()
+        finally:
+            if self.observer:
+                self.observer.stop()
+                self.observer.join()
+            self.pool.shutdown(wait=True)
+
+def run_watch_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --watch", description="Redline new revisions as they land in watched folders.")
+    parser.add_argument("roots", nargs="+", help="Folders to watch (recursively)")
+    parser.add_argument("--state", default=WATCH_STATE, help="Processed-files state (default: %(default)s)")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds a file must stay unchanged before it is used (default: %(default)s)")
+    parser.add_argument("--poll", type=float, default=10.0, help="Polling interval when watchdog is unavailable (default: %(default)s)")
+    parser.add_argument("--backfill", action="store_true", help="On first run, also redline files already present")
+    add_pipeline_args(parser)
+    args = parser.parse_args(argv)
+
+    cache, engine, workers_3d = build_pipeline(args)
+    watcher = RedlineWatcher(args.roots, args.state, args.settle, args.poll, args.jobs, args.output_dir,
+                             cache, engine, workers_3d, args.backfill, text_gate=args.text_gate)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if workers_3d: workers_3d.close()
+    return 0
+
+# --- COMPARISON SERVICE (Shared by every GUI on the machine) ---
+class ServiceFull(Exception):
+    pass
+
+class ComparisonService:
+    """
+    Runs comparison jobs for many clients on a bounded pool. A request whose inputs and options
+    match a job that is still queued or running joins that job instead of queueing a second one;
+    past queue_max waiting jobs, submit() raises ServiceFull so clients back off.
+    """
+    def __init__(self, jobs=None, queue_max=SERVICE_QUEUE_MAX, cache=None, engine=None, keep=SERVICE_KEEP_JOBS, text_gate=False):
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.queue_max = queue_max
+        self.cache = cache
+        self.engine = engine or get_diff_engine()
+        self.text_gate = text_gate
+        self.keep = keep
+        self.keyer = cache or RedlineCache() # Only used for its content keys
+        self.out_dir = tempfile.mkdtemp(prefix="diffpdf-service-")
+        self.lock = threading.Lock()
+        self.records = {}    # job id -> record
+        self.in_flight = {}  # content key -> job id
+        self.finished = []   # job ids, oldest first
+        self.queued = 0
+        self.pool = ThreadPoolExecutor(max_workers=self.jobs)
+
+    @staticmethod
+    def public(record):
+        return {k: v for k, v in record.items() if not k.startswith('_')}
+
+    def submit(self, file_a, file_b):
+        """Returns (record, deduplicated). Raises ServiceFull, or OSError for unreadable inputs."""
+        key = self.keyer.key(file_a, file_b, diff_options(self.engine, self.text_gate))
+        with self.lock:
+            job_id = self.in_flight.get(key)
+            if job_id:
+                self.records[job_id]['clients'] += 1
+                return self.public(self.records[job_id]), True
+            if self.queued >= self.queue_max:
+                raise ServiceFull(f"{self.queued} jobs waiting")
+            job_id = uuid.uuid4().hex[:12]
+            record = self.records[job_id] = {
+                'id': job_id, 'file_a': file_a, 'file_b': file_b, 'status': 'queued', 'clients': 1,
+                'progress': None, 'returncode': None, 'cached': False, 'seconds': None, 'result': None,
+            }
+            self.in_flight[key] = job_id
+            self.queued += 1
+        self.pool.submit(self._run, key, job_id)
+        return self.public(record), False
+
+    def _run(self, key, job_id):
+        with self.lock:
+            record = self.records[job_id]
+            record['status'] = 'running'
+            self.queued -= 1
+        output_path = os.path.join(self.out_dir, f"{job_id}.pdf")
+        start = time.perf_counter()
+
+        def progress(done, total, *page):
+            record['progress'] = [done, total, *page]
+
+        try:
+            res, record['cached'] = run_pdf_diff_cached(record['file_a'], record['file_b'], output_path, self.cache, engine=self.engine, progress=progress, text_gate=self.text_gate)
+            record['returncode'] = res.returncode
+            if getattr(res, 'gated_pages', None): record['gated_pages'] = res.gated_pages
+            if res.returncode in [0, 1] and os.path.exists(output_path):
+                record['_output'] = output_path
+                record['result'] = f"/jobs/{job_id}/result"
+            if res.returncode not in [0, 1]: record['error'] = res.stderr.strip()
+            status = {0: 'identical', 1: 'different'}.get(res.returncode, 'error')
+        except Exception as e:
+            record['error'] = str(e)
+            status = 'error'
+        with self.lock:
+            record['seconds'] = round(time.perf_counter() - start, 3)
+            record['status'] = status
+            del self.in_flight[key]
+            self.finished.append(job_id)
+            while len(self.finished) > self.keep:
+                old = self.records.pop(self.finished.pop(0))
+                if old.get('_output'):
+                    try: os.remove(old['_output'])
+                    except OSError: pass
+
+    def status(self, job_id):
+        with self.lock:
+            record = self.records.get(job_id)
+            return self.public(record) if record else None
+
+    def output(self, job_id):
+        with self.lock:
+            record = self.records.get(job_id)
+            return record and record.get('_output')
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.jobs,
+                'queue_max': self.queue_max,
+                'queued': self.queued,
+                'running': len(self.in_flight) - self.queued,
+                'jobs': len(self.records),
+                'engine': self.engine.options(),
+                'text_gate': self.text_gate,
+            }
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs {"file_a", "file_b"} -> 202 job (503 + Retry-After when the queue is full)
+    GET  /jobs/<id>                 -> job status
+    GET  /jobs/<id>/result          -> redline PDF once the job has finished
+    GET  /status                    -> pool and queue counters
+    """
+    def log_message(self, fmt, *args):
+        log_debug("SERVICE: " + fmt % args)
+
+    def _json(self, code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["status"]:
+            return self._json(200, service.stats())
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or (len(parts) == 3 and parts[2] != "result"):
+            return self._json(404, {'error': "not found"})
+        record = service.status(parts[1])
+        if record is None:
+            return self._json(404, {'error': "unknown job"})
+        if len(parts) == 2:
+            return self._json(200, record)
+        if record['status'] in ('queued', 'running'):
+            return self._json(409, {'error': "job not finished", 'status': record['status']})
+        output = service.output(parts[1])
+        if not output or not os.path.exists(output):
+            return self._json(404, {'error': "job produced no redline", 'status': record['status']})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(os.path.getsize(output)))
+        self.end_headers()
+        with open(output, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._json(404, {'error': "not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            file_a, file_b = body['file_a'], body['file_b']
+            if not isinstance(file_a, str) or not isinstance(file_b, str): raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return self._json(400, {'error': "expected JSON with file_a and file_b paths"})
+        missing = [f for f in (file_a, file_b) if not os.path.isfile(f)]
+        if missing:
+            return self._json(400, {'error': f"not readable by the service: {', '.join(missing)}"})
+        try:
+            record, deduplicated = self.server.service.submit(file_a, file_b)
+        except ServiceFull as e:
+            return self._json(503, {'error': f"queue full ({e})"}, {"Retry-After": "2"})
+        except OSError as e:
+            return self._json(400, {'error': str(e)})
+        self._json(202, dict(record, deduplicated=deduplicated), {"Location": f"/jobs/{record['id']}"})
+
+class ComparisonClient:
+    """GUI side of the service: submits a pair, follows it to completion and downloads the redline."""
+    def __init__(self, url=SERVICE_URL, timeout=10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None, timeout=None):
+        """Returns (status, headers, data); HTTP error statuses are returned, not raised."""
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def available(self):
+        try:
+            return self._request("GET", "/status", timeout=0.5)[0] == 200
+        except OSError:
+            return False
+
+    def submit(self, file_a, file_b, cancelled=None):
+        """Queues a pair, waiting out backpressure. Returns the job record, or None if cancelled while waiting."""
+        while True:
+            status, headers, data = self._request("POST", "/jobs", {'file_a': file_a, 'file_b': file_b})
+            if status == 202:
+                return json.loads(data)
+            if status != 503:
+                raise RuntimeError(f"service refused job ({status}): {data.decode(errors='replace')}")
+            deadline = time.monotonic() + float(headers.get("Retry-After") or 2)
+            while time.monotonic() < deadline:
+                if cancelled and cancelled(): return None
+                time.sleep(0.1)
+
+    def status(self, job_id):
+        status, _, data = self._request("GET", f"/jobs/{job_id}")
+        if status != 200:
+            raise RuntimeError(f"job {job_id} lost ({status})")
+        return json.loads(data)
+
+    def fetch(self, job_id, dest):
+        status, _, data = self._request("GET", f"/jobs/{job_id}/result", timeout=max(self.timeout, 60))
+        if status != 200:
+            raise RuntimeError(f"no result for job {job_id} ({status})")
+        with open(dest, "wb") as f:
+            f.write(data)
+
+    def diff(self, file_a, file_b, output_path, on_start=None, progress=None, poll=0.25):
+        """Same contract as run_pdf_diff_cached(): returns (CompletedProcess, cached)."""
+        # kill() only stops this client waiting; the job may be shared, so it runs on for the others
+        run = RasterRun()
+        if on_start: on_start(run)
+        job = self.submit(os.path.abspath(file_a), os.path.abspath(file_b), run.cancelled.is_set)
+        while job and job['status'] in ('queued', 'running'):
+            if run.cancelled.is_set(): break
+            if progress and job.get('progress'): progress(*job['progress'])
+            time.sleep(poll)
+            job = self.status(job['id'])
+        if job is None or run.cancelled.is_set():
+            run.returncode = -9
+            return subprocess.CompletedProcess([], -9, "", "cancelled"), False
+
+        run.returncode = job['returncode'] if job['returncode'] is not None else 2
+        if job['status'] == 'error':
+            return subprocess.CompletedProcess([], run.returncode, "", job.get('error', "")), False
+        if job.get('result'):
+            self.fetch(job['id'], output_path)
+        return subprocess.CompletedProcess([], run.returncode, f"service job {job['id']}", ""), job['cached']
+
+def is_loopback_host(host):
+    if host.lower() == 'localhost': return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def run_service_cli(argv):
+    parser = argparse.ArgumentParser(prog="diff-pdf-gui --serve", description="Run a shared comparison service for the GUIs on this machine.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Interface to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="Allow a non-loopback --host. The service has no authentication and reads any path it is given, "
+                             "so only use this on a trusted network")
+    parser.add_argument("--queue", type=int, default=SERVICE_QUEUE_MAX, help="Waiting jobs accepted before returning 503 (default: %(default)s)")
+    add_pipeline_args(parser, outputs=False, render_3d=False)
+    args = parser.parse_args(argv)
+    if not args.allow_remote and not is_loopback_host(args.host):
+        parser.error(f"--host {args.host} is not a loopback address; pass --allow-remote to expose the service")
+
+    cache, engine, _ = build_pipeline(args)
+    service = ComparisonService(args.jobs, args.queue, cache, engine, text_gate=args.text_gate)
+    server = ThreadingHTTPServer((args.host, args.port), _ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving comparisons on http://{args.host}:{server.server_port} ({service.jobs} workers, queue {service.queue_max})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+# --- BACKGROUND JOBS (Keeps the Tk loop responsive) ---
+class DiffJob:
+    """One queued comparison. 'process' holds the running child so it can be killed on cancel."""
+    def __init__(self, file_a, file_b, output_path, want_3d):
+        self.file_a = file_a
+        self.file_b = file_b
+        self.output_path = output_path
+        self.want_3d = want_3d
+        self.cancelled = False
+        self.process = None
+
+    def attach_process(self, proc):
+        self.process = proc
+        # Cancel may have arrived between queueing and process start
+        if self.cancelled: self.kill()
+
+    def kill(self):
+        proc = self.process
+        if proc and proc.poll() is None:
+            try: proc.kill()
+            except: pass
+
+class DiffJobQueue:
+    """FIFO of DiffJobs executed one at a time by runner(job) on a daemon worker thread."""
+    def __init__(self, runner):
+        self.runner = runner
+        self.jobs = queue.Queue()
+        self.current = None
+        self.lock = threading.Lock()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, job):
+        """Queues job and returns how many jobs are ahead of it."""
+        with self.lock:
+            ahead = self.jobs.qsize() + (1 if self.current else 0)
+        self.jobs.put(job)
+        return ahead
+
+    def pending(self):
+        return self.jobs.qsize()
+
+    def cancel_current(self):
+        """Kills the running job's process. Returns False when nothing is running."""
+        with self.lock:
+            job = self.current
+        if not job: return False
+        job.cancelled = True
+        job.kill()
+        return True
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.current = job
+            try:
+                self.runner(job)
+            except Exception as e:
+                print(f"Job Error: {e}")
+            finally:
+                with self.lock:
+                    self.current = None
+
 # --- GUI LOGIC ---
 class DiffPDFApp:
     def __init__(self, master):
@@ -156,9 +2534,26 @@ class DiffPDFApp:
                                         variable=self.check_3d_var, onvalue=True, offvalue=False)
         self.check_3d.grid(row=4, column=0, pady=(15, 5), sticky='w')
 
-        # --- Row 5: Run Button ---
-        self.run_button = ttk.Button(main_frame, text="COMPARE FILES", command=self.run_diff, style='Accent.TButton', width=25)
-        self.run_button.grid(row=5, column=0, pady=(20, 5))
+        # 3D availability comes from the cached probe when possible, otherwise a background probe
+        self.diff3d_available = None
+        self.workers_3d = None
+        self.probe_done = threading.Event()
+        cached = load_cached_capabilities()
+        if cached is not None:
+            self.apply_capabilities(cached)
+        else:
+            self.check_3d.config(state='disabled', text="Auto-diff matching .STEP files (checking 3D libraries...)")
+            threading.Thread(target=lambda: self.master.after(0, self.apply_capabilities, probe_capabilities()), daemon=True).start()
+
+        # --- Row 5: Run / Cancel Buttons ---
+        run_frame = ttk.Frame(main_frame)
+        run_frame.grid(row=5, column=0, pady=(20, 5))
+
+        self.run_button = ttk.Button(run_frame, text="COMPARE FILES", command=self.run_diff, style='Accent.TButton', width=25)
+        self.run_button.pack(side='left', padx=(0, 10))
+
+        self.cancel_btn = ttk.Button(run_frame, text="■ Cancel", command=self.cancel_diff, style='Control.TButton', width=10, state='disabled')
+        self.cancel_btn.pack(side='left')
 
         # --- Row 6: Status ---
         self.status_label = ttk.Label(main_frame, text="Ready. Drag files above.", foreground='#666', font=('Segoe UI', 10))
@@ -166,12 +2561,49 @@ class DiffPDFApp:
 
         main_frame.grid_columnconfigure(0, weight=1)
 
+        # Comparisons run on a worker thread; the UI only ever queues them
+        self.cache = RedlineCache()
+        self.engine = get_diff_engine()
+        if engine_unavailable(self.engine):
+            self.status_label.config(text="⚠️ " + engine_unavailable(self.engine), foreground='#D32F2F')
+        self.job_queue = DiffJobQueue(self.process_job)
+
+        # A running --serve instance takes the PDF work so it is done once for everyone
+        self.service = None
+        threading.Thread(target=self.connect_service, daemon=True).start()
+
         # Attach listeners
         # When A changes -> Try to fill B (Next Revision)
         self.file_a_path.trace_add("write", lambda *args: self.on_path_change(self.file_a_path, self.file_b_path, self.drop_zone_b, mode="next"))
         # When B changes -> Try to fill A (Previous Revision)
         self.file_b_path.trace_add("write", lambda *args: self.on_path_change(self.file_b_path, self.file_a_path, self.drop_zone_a, mode="prev"))
 
+    def connect_service(self):
+        client = ComparisonClient()
+        if client.available():
+            self.service = client
+            log_debug(f"Using comparison service at {client.url}")
+
+    def compare_pdfs(self, job, progress):
+        """Runs the PDF comparison on the shared service when one is reachable, otherwise locally."""
+        if self.service:
+            try:
+                return self.service.diff(job.file_a, job.file_b, job.output_path, on_start=job.attach_process, progress=progress)
+            except (OSError, RuntimeError, ValueError) as e:
+                log_debug(f"SERVICE ERROR: {e}")
+        return run_pdf_diff_cached(job.file_a, job.file_b, job.output_path, self.cache, on_start=job.attach_process, engine=self.engine, progress=progress)
+
+    def apply_capabilities(self, capabilities):
+        self.diff3d_available = capabilities.get('diff3d', False)
+        if self.diff3d_available:
+            self.check_3d.config(state='normal', text="Auto-diff matching .STEP files (requires 'diff3d' & 'build123d')")
+            if self.workers_3d is None:
+                self.workers_3d = Diff3DWorkerPool()
+        else:
+            self.check_3d_var.set(False)
+            self.check_3d.config(state='disabled', text="Auto-diff .STEP files unavailable (pip install diff3d build123d pyvista)")
+        self.probe_done.set()
+
     def swap_files(self):
         self.is_internal_update = True 
         val_a = self.file_a_path.get()
@@ -201,19 +2633,7 @@ class DiffPDFApp:
 
     def extract_revision(self, filename):
         """Finds a revision number in a filename. Returns (prefix, separator, number, suffix)."""
-        # Priority 1: Explicit 'Rev' or 'v' (greedy start ensures we find the LAST instance)
-        # matches "Part_Rev1_..." -> "Part_", "Rev", "1", "_..."
-        match = re.search(r'(.*)(Rev|v)(\d+)(.*)', filename, re.IGNORECASE)
-        if match:
-            return match.groups()
-            
-        # Priority 2: Underscore or Hyphen separator (greedy start)
-        # matches "Part-02" -> "Part", "-", "02", ""
-        match = re.search(r'(.*)(_|-)(\d+)(.*)', filename, re.IGNORECASE)
-        if match:
-            return match.groups()
-            
-        return None
+        return extract_revision(filename)
 
     def on_path_change(self, changed_var, target_var, target_widget, mode="next"):
         """
@@ -233,55 +2653,7 @@ class DiffPDFApp:
 
         try:
             directory = os.path.dirname(current_path)
-            filename = os.path.basename(current_path)
-            name_no_ext, ext = os.path.splitext(filename)
-
-            candidates = [f for f in os.listdir(directory) if f.lower().endswith(ext.lower()) and f != filename]
-            
-            best_match_file = None
-            
-            # 1. Try smart revision matching first
-            rev_info = self.extract_revision(name_no_ext)
-            
-            if rev_info:
-                prefix, sep, num_str, suffix = rev_info
-                try:
-                    current_rev = int(num_str)
-                    
-                    valid_candidates = []
-                    for cand in candidates:
-                        cand_name = os.path.splitext(cand)[0]
-                        cand_rev_info = self.extract_revision(cand_name)
-                        if cand_rev_info:
-                            c_prefix, c_sep, c_num_str, c_suffix = cand_rev_info
-                            # Check prefix matches (ignoring the revision number part)
-                            if c_prefix.lower() == prefix.lower(): 
-                                try:
-                                    c_rev = int(c_num_str)
-                                    valid_candidates.append((c_rev, cand))
-                                except:
-                                    pass
-
-                    valid_candidates.sort(key=lambda x: x[0])
-                    
-                    if mode == "next":
-                        # Find smallest revision > current_rev
-                        potential = [x for x in valid_candidates if x[0] > current_rev]
-                        if potential: best_match_file = potential[0][1]
-                            
-                    elif mode == "prev":
-                        # Find largest revision < current_rev
-                        potential = [x for x in valid_candidates if x[0] < current_rev]
-                        if potential: best_match_file = potential[-1][1]
-
-                except Exception as e:
-                    print(f"Revision parse error: {e}")
-
-            # 2. Fallback only if NO revision info was found in source (avoids matching wrong revs)
-            if not best_match_file and candidates and not rev_info:
-                matches = difflib.get_close_matches(filename, candidates, n=1, cutoff=0.6)
-                if matches:
-                    best_match_file = matches[0]
+            best_match_file = find_revision_match(current_path, mode)
 
             if best_match_file:
                 match_path = os.path.join(directory, best_match_file)
@@ -338,11 +2710,11 @@ class DiffPDFApp:
         if filepath: path_var.set(filepath)
 
     def find_step_file(self, pdf_path):
-        if not pdf_path: return None
-        base_path = os.path.splitext(pdf_path)[0]
-        for ext in ['.step', '.stp', '.STEP', '.STP']:
-            if os.path.exists(base_path + ext): return base_path + ext
-        return None
+        return find_step_file(pdf_path)
+
+    def set_status(self, text, foreground='#666', font=('Segoe UI', 10)):
+        """Thread-safe status update; marshals onto the Tk loop via after()."""
+        self.master.after(0, lambda: self.status_label.config(text=text, foreground=foreground, font=font))
 
     def run_diff(self):
         file_a, file_b = self.file_a_path.get(), self.file_b_path.get()
@@ -353,71 +2725,194 @@ class DiffPDFApp:
         default_name = "diff_result.pdf"
         if file_b:
             try:
-                base_name = os.path.splitext(os.path.basename(file_b))[0]
-                default_name = f"{base_name}-Redline.pdf"
+                default_name = default_redline_name(file_b)
             except:
                 pass
 
         output_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files", "*.pdf")], initialfile=default_name)
         if not output_path: return
 
-        self.status_label.config(text="Processing...", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
-        self.master.update()
-
-        # 1. PDF Diff
-        pdf_success = False
-        try:
-            cmd = [DIFF_PDF_COMMAND, f'--output-diff={os.path.normpath(output_path)}', os.path.normpath(file_b), os.path.normpath(file_a)]
-            res = subprocess.run(cmd, capture_output=True, text=True, check=False, cwd=DIFF_PDF_DIR, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0)
-            if res.returncode in [0, 1]: pdf_success = True
-            elif res.returncode in [2, 3] or "Error opening" in res.stderr:
-                messagebox.showerror("Blocked", f"Could not write PDF.\nPlease whitelist 'pdf-diff-gui.exe'.\n\nDetails: {res.stderr}")
-        except Exception as e: print(f"PDF Error: {e}")
-
-        # 2. 3D Diff
-        step_msg = ""
-        if self.check_3d_var.get():
-            step_a, step_b = self.find_step_file(file_a), self.find_step_file(file_b)
-            if step_a and step_b:
-                save_dir = os.path.dirname(output_path)
-                target_img = os.path.join(save_dir, os.path.splitext(os.path.basename(output_path))[0] + ".png")
-                
-                # Check libraries
-                try:
-                    subprocess.run([sys.executable, "-c", "import diff3d, pyvista, build123d"], check=True, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0)
-                    diff3d_ok = True
-                except: diff3d_ok = False
-
-                if diff3d_ok:
-                    def run_3d():
-                        try:
-                            # Use a strict flag --run-3d-viewer
-                            if getattr(sys, 'frozen', False):
-                                cmd = [sys.executable, "--run-3d-viewer", step_a, step_b, save_dir]
-                            else:
-                                cmd = [sys.executable, os.path.abspath(__file__), "--run-3d-viewer", step_a, step_b, save_dir]
-                            
-                            subprocess.run(cmd, creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0)
-                            
-                            default_ss = os.path.join(save_dir, "screenshot.png")
-                            if os.path.exists(default_ss):
-                                if os.path.exists(target_img): os.remove(target_img)
-                                os.rename(default_ss, target_img)
-                                self.master.after(0, lambda: self.status_label.config(text=f"✔ PDF & 3D Image Saved.", foreground='green'))
-                            else:
-                                self.master.after(0, lambda: self.status_label.config(text=f"✔ PDF Saved (3D: No capture).", foreground='green'))
-                        except Exception as e: print(f"3D Error: {e}")
-
-                    threading.Thread(target=run_3d, daemon=True).start()
-                    self.status_label.config(text="3D View Open... Rotate to Auto-Save...", foreground='#9B84D3')
+        job = DiffJob(file_a, file_b, output_path, self.check_3d_var.get())
+        ahead = self.job_queue.submit(job)
+        self.cancel_btn.config(state='normal')
+        if ahead:
+            self.status_label.config(text=f"Queued: {os.path.basename(file_b)} ({ahead} ahead)", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
+        else:
+            self.status_label.config(text="Processing...", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
+
+    def cancel_diff(self):
+        if self.job_queue.cancel_current():
+            self.status_label.config(text="Cancelling...", foreground='#D32F2F', font=('Segoe UI', 10, 'italic'))
+
+    def finish_job(self):
+        """Called on the worker thread when a job ends; idles the cancel button once the queue drains."""
+        if not self.job_queue.pending():
+            self.master.after(0, lambda: self.cancel_btn.config(state='disabled'))
+
+    def process_job(self, job):
+        """Runs one comparison. Executes on the DiffJobQueue worker thread, never on the Tk loop."""
+        file_a, file_b, output_path = job.file_a, job.file_b, job.output_path
+        queued = self.job_queue.pending()
+        suffix = f" ({queued} queued)" if queued else ""
+        self.set_status(f"Processing {os.path.basename(file_b)}...{suffix}", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
+
+        try:
+            def page_progress(done, total, page=None, pages=None):
+                where = f"page {done}/{total}" if page is None else f"page {page}/{pages} (changed page {done} of {total})"
+                self.set_status(f"Comparing {os.path.basename(file_b)}: {where}{suffix}", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
+
+            # 1. PDF Diff
+            pdf_success = False
+            pdf_cached = False
+            try:
+                res, pdf_cached = self.compare_pdfs(job, page_progress)
+                if job.cancelled:
+                    self.set_status("✘ Comparison cancelled.", foreground='#D32F2F', font=('Segoe UI', 10, 'bold'))
                     return
-                else: messagebox.showwarning("Missing Library", "Please run: pip install diff3d build123d pyvista")
+                missing = engine_unavailable(self.engine)
+                if res.returncode in [0, 1]: pdf_success = True
+                elif missing and res.stderr == missing:
+                    self.master.after(0, lambda: messagebox.showerror("Missing Library", missing))
+                elif res.returncode in [2, 3] or "Error opening" in res.stderr:
+                    self.master.after(0, lambda: messagebox.showerror("Blocked", f"Could not write PDF.\nPlease whitelist 'pdf-diff-gui.exe'.\n\nDetails: {res.stderr}"))
+            except Exception as e: print(f"PDF Error: {e}")
 
-        if pdf_success: self.status_label.config(text=f"✔ PDF Saved.", foreground='green', font=('Segoe UI', 10, 'bold'))
-        else: self.status_label.config(text=f"✘ PDF Failed.", foreground='red', font=('Segoe UI', 10, 'bold'))
+            # 2. 3D Diff
+            if job.want_3d:
+                step_a, step_b = find_step_file(file_a), find_step_file(file_b)
+                if step_a and step_b:
+                    save_dir = os.path.dirname(output_path)
+                    target_img = os.path.join(save_dir, os.path.splitext(os.path.basename(output_path))[0] + ".png")
+
+                    # A previous capture of the same STEP pair is reused instead of reopening the viewer
+                    step_key = None
+                    try:
+                        step_key = self.cache.key(step_a, step_b, {'kind': '3d-screenshot'})
+                        if self.cache.lookup(step_key) and self.cache.fetch(step_key, 'screenshot.png', target_img):
+                            if pdf_success: self.set_status("✔ PDF & 3D Image Saved (cached).", foreground='green', font=('Segoe UI', 10, 'bold'))
+                            else: self.set_status("✘ PDF Failed (3D Image Saved, cached).", foreground='red', font=('Segoe UI', 10, 'bold'))
+                            return
+                    except Exception as e: log_debug(f"CACHE ERROR: {e}")
+                    
+                    # Check libraries (startup probe; only waits if it hasn't finished yet)
+                    if not self.probe_done.is_set():
+                        self.set_status("Checking 3D libraries...", foreground='#9B84D3', font=('Segoe UI', 10, 'italic'))
+                        self.probe_done.wait()
+                    diff3d_ok = self.diff3d_available
+
+                    if diff3d_ok:
+                        def run_3d():
+                            try:
+                                # A warm worker has the 3D stack imported already
+                                result = self.workers_3d.run({'step_a': step_a, 'step_b': step_b, 'image': target_img})
+                                if result.get('ok'):
+                                    if step_key:
+                                        try: self.cache.store(step_key, {'screenshot.png': target_img})
+                                        except Exception as e: log_debug(f"CACHE ERROR: {e}")
+                                    if pdf_success: self.set_status("✔ PDF & 3D Image Saved.", foreground='green')
+                                    else: self.set_status("✘ PDF Failed (3D Image Saved).", foreground='red')
+                                elif pdf_success:
+                                    self.set_status("✔ PDF Saved (3D: No capture).", foreground='green')
+                                else:
+                                    self.set_status("✘ PDF Failed (3D: No capture).", foreground='red')
+                            except Exception as e: print(f"3D Error: {e}")
+
+                        # The viewer waits on the user, so it must not hold up the queue
+                        threading.Thread(target=run_3d, daemon=True).start()
+                        self.set_status("3D View Open... Rotate to Auto-Save...", foreground='#9B84D3')
+                        return
+                    else: self.master.after(0, lambda: messagebox.showwarning("Missing Library", "Please run: pip install diff3d build123d pyvista"))
+
+            if pdf_success and pdf_cached: self.set_status("✔ PDF Saved (cached).", foreground='green', font=('Segoe UI', 10, 'bold'))
+            elif pdf_success: self.set_status("✔ PDF Saved.", foreground='green', font=('Segoe UI', 10, 'bold'))
+            else: self.set_status("✘ PDF Failed.", foreground='red', font=('Segoe UI', 10, 'bold'))
+        finally:
+            self.finish_job()
+
+def run_profiled():
+    """
+    --profile: records stage spans for this process and its children, then prints per-stage totals.
+    --profile-cprofile PATH additionally dumps cProfile stats (view with 'python -m pstats PATH').
+    """
+    import cProfile
+    sys.argv.remove("--profile")
+    cprofile_path = None
+    if "--profile-cprofile" in sys.argv:
+        idx = sys.argv.index("--profile-cprofile")
+        cprofile_path = sys.argv[idx + 1] if len(sys.argv) > idx + 1 else "diff-pdf-gui.prof"
+        del sys.argv[idx:idx + 2]
+
+    session = enable_tracing(TRACE_PATH)
+    profiler = cProfile.Profile() if cprofile_path else None
+    code = 0
+    try:
+        if profiler: profiler.enable()
+        run_mode()
+    except SystemExit as e:
+        code = e.code
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        flush_tracing()
+        summary = format_stage_summary(summarize_trace(TRACE_PATH, session))
+        summary_path = os.path.join(APP_DIR, "profile_summary.txt")
+        try:
+            with open(summary_path, "w") as f: f.write(summary + "\n")
+        except OSError:
+            pass
+        if sys.stdout:
+            print(summary)
+            print(f"Spans: {TRACE_PATH} (session {session})" + (f", cProfile: {cprofile_path}" if cprofile_path else ""))
+    return code
 
 def main():
+    if "--profile" in sys.argv:
+        sys.exit(run_profiled())
+    run_mode()
+
+def run_mode():
+    # --- HEADLESS BATCH MODE ---
+    if "--batch" in sys.argv:
+        idx = sys.argv.index("--batch")
+        sys.exit(run_batch_cli(sys.argv[idx + 1:]))
+
+    # --- SHARED COMPARISON SERVICE ---
+    if "--serve" in sys.argv:
+        idx = sys.argv.index("--serve")
+        sys.exit(run_service_cli(sys.argv[idx + 1:]))
+
+    # --- REVISION CHAIN ---
+    if "--chain" in sys.argv:
+        idx = sys.argv.index("--chain")
+        sys.exit(run_chain_cli(sys.argv[idx + 1:]))
+
+    # --- WATCH-FOLDER DAEMON ---
+    if "--watch" in sys.argv:
+        idx = sys.argv.index("--watch")
+        sys.exit(run_watch_cli(sys.argv[idx + 1:]))
+
+    # --- TEXT-LAYER TRIAGE ---
+    if "--text-diff" in sys.argv:
+        idx = sys.argv.index("--text-diff")
+        sys.exit(run_text_diff_cli(sys.argv[idx + 1:]))
+
+    # --- CACHE MAINTENANCE ---
+    if "--cache" in sys.argv:
+        idx = sys.argv.index("--cache")
+        sys.exit(run_cache_cli(sys.argv[idx + 1:]))
+
     # --- INTERNAL DISPATCHER (Strict Flag Check) ---
+    if "--probe-3d" in sys.argv:
+        sys.exit(run_probe_mode())
+
+    if "--run-3d-worker" in sys.argv:
+        sys.exit(run_3d_worker_mode(headless="--headless" in sys.argv))
+
+    if "--render-3d" in sys.argv:
+        idx = sys.argv.index("--render-3d")
+        sys.exit(run_render_3d_cli(sys.argv[idx + 1:]))
+
     if "--run-3d-viewer" in sys.argv:
         try:
             log_debug("Found 3D flag. Entering 3D logic.")
@@ -429,10 +2924,10 @@ def main():
                 save_dir = sys.argv[idx + 3]
                 run_3d_viewer_mode(file_a, file_b, save_dir)
             else:
-                log_debug(f"ERROR: Not enough args after flag. Args: {sys.argv}")
+                log_debug(f"ERROR: Not enough args after flag. Args: {sys.argv}", flush=True)
 
         except Exception as e:
-            log_debug(f"DISPATCH ERROR: {e}")
+            log_debug(f"DISPATCH ERROR: {e}", flush=True)
         
         sys.exit(0) 
 
@@ -443,4 +2938,5 @@ def main():
     root.mainloop()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support() # Raster engine workers in the PyInstaller build
     main()
@@ -0,0 +1,72 @@
+"""
+Regression tests for the redline cache.
+
+    python -m unittest discover tests
+
+diff-pdf.exe is replaced by the benchmarks' fake_diff_pdf.py; the tests need PyMuPDF.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "benchmarks"))
+import bench
+import corpus
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+
+@unittest.skipUnless(pymupdf, "needs PyMuPDF")
+class CachedOutputTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = bench.load_app()
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="diffpdf-test-")
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        bench.install_fake_diff_pdf(self.app, self.workdir, latency=0)
+        series = corpus.make_revision_pdfs(os.path.join(self.workdir, "pdfs"), drawings=1, revisions=3, pages=4, changed_pages=1)
+        self.rev1, self.rev2, self.rev3 = list(series.values())[0]
+        # A sheet added in Rev3 sends that comparison to the engine as a whole file
+        with pymupdf.open(self.rev3) as doc:
+            doc.new_page(width=1190, height=842)
+            doc.saveIncr()
+        self.cache = self.app.RedlineCache(os.path.join(self.workdir, "cache"))
+        self.engine = self.app.DiffPdfEngine()
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_uncached_run_does_not_write_through_a_cache_hit(self):
+        out = os.path.join(self.workdir, "redline.pdf")
+        options = self.app.diff_options(self.engine)
+        entry = os.path.join(self.cache.entry_dir(self.cache.key(self.rev1, self.rev2, options)), "redline.pdf")
+
+        res, hit = self.app.run_pdf_diff_cached(self.rev1, self.rev2, out, self.cache, engine=self.engine)
+        self.assertEqual((res.returncode, hit), (1, False))
+        res, hit = self.app.run_pdf_diff_cached(self.rev1, self.rev2, out, self.cache, engine=self.engine)
+        self.assertEqual((res.returncode, hit), (1, True))
+        stored = self.read(entry)
+
+        # Same output path, a different comparison and no cache: the stored redline must not change
+        res, hit = self.app.run_pdf_diff_cached(self.rev1, self.rev3, out, None, engine=self.engine)
+        self.assertEqual((res.returncode, hit), (1, False))
+        self.assertNotEqual(self.read(out), stored)
+        self.assertEqual(self.read(entry), stored)
+
+        res, hit = self.app.run_pdf_diff_cached(self.rev1, self.rev2, out, self.cache, engine=self.engine)
+        self.assertTrue(hit)
+        self.assertEqual(self.read(out), stored)
+        self.assertFalse([n for n in os.listdir(self.workdir) if n.endswith(".tmp")])
+
+
+if __name__ == '__main__':
+    unittest.main()